@@ -0,0 +1,248 @@
+# fake_faa.py
+# Support file for ledmap.py - Mark Harris
+# Stand-in for the FAA's METAR server, for testing the map without the internet and for
+# load testing with many more airports than the real maps have, without bothering the FAA.
+#
+# It answers '/api/data/metar' with made up METARs for the 'ids' asked for, in xml, json or csv
+# like the FAA, or '204 No Content' if there are none. A METAR is made for every hour, the ones within 'hours' are returned. The weather
+# of each airport is picked at random but stays the same until the next hour, with about as much
+# rain, snow, fog, thunderstorms and wind as a typical day. The visibility and clouds match the flight
+# category, which is left out of about 1 in 20 METARs like the FAA sometimes does. If 'stations.bin' has been built, see
+# station_db.py, airports are put where they really are, otherwise they are put somewhere in the USA.
+#
+# Start it, then point ledmap.py at it with 'metar_url';
+#   python3 fake_faa.py port=8080 latency=0.5 fail_rate=0.1
+#   sudo python3 ledmap.py metar_url=http://localhost:8080/api/data/metar
+#
+# Variables that can be passed on the command line;
+#    port=8080        # Port to listen on
+#    latency=0        # Seconds to wait before answering each request
+#    jitter=0         # Up to this many seconds more are added to the wait at random
+#    fail_rate=0      # Part of the requests to fail, i.e. 0.1 fails 1 in 10. Half get an error, half are cut off
+#
+# make_station_ids() makes up as many airport ids as wanted, i.e. for a load test 10 times the
+# size of 'ap_3000_dict'. To run one, fetching with metar_fetch.py from the fake server;
+#    python3 fake_faa.py load_test=30000
+
+import sys
+import gzip
+import json
+import time
+import random
+import hashlib
+import threading
+import urllib.parse
+import http.server
+from station_db import load_stations, STATION_FILE
+
+PORT = 8080
+CATEGORY_WEIGHTS = [("VFR", 70), ("MVFR", 15), ("IFR", 10), ("LIFR", 5)]
+WX_WEIGHTS = [("", 72), ("-RA", 6), ("RA", 3), ("+RA", 1), ("-RA BR", 3), ("BR", 4), ("FG", 1), ("-SN", 2),
+              ("SN", 1), ("BLSN", 1), ("-TSRA", 1), ("TS", 1), ("VCTS", 1), ("-FZRA", 1), ("HZ", 2)]
+# flight category : (visibility, lowest and highest cloud base of the ceiling)
+CATEGORY_WEATHER = {"VFR": (10, 3500, 12000), "MVFR": (4, 1500, 3000), "IFR": (2, 600, 900), "LIFR": (0.5, 100, 400)}
+NO_CATEGORY_RATE = 0.05 # Part of the METARs without a flight category
+
+latency = 0
+jitter = 0
+fail_rate = 0
+stations = {} # station_id : Station, from stations.bin if it has been built
+
+
+def pick(rand, weights): # Pick one of the values at random, using its weight
+    return(rand.choices([value for value, weight in weights], [weight for value, weight in weights])[0])
+
+
+def make_station_ids(count): # Made up airport ids, 'Z' followed by 3 letters/numbers
+    chars = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+    ids = []
+    for num in range(count):
+        code = ''
+        for place in range(3):
+            code = chars[num % 36] + code
+            num //= 36
+        ids.append('Z' + code)
+    return(ids)
+
+
+def make_metar(station_id, obs_time): # Made up METAR for an airport at an hour, the same every time it is asked for
+    rand = random.Random(station_id + str(obs_time))
+    station = stations.get(station_id)
+    if station is not None:
+        lat, lon = station.lat, station.lon
+    else: # somewhere in the USA that stays the same for the airport
+        place = random.Random(station_id)
+        lat, lon = round(place.uniform(25, 49), 4), round(place.uniform(-124, -67), 4)
+    wind = min(int(rand.expovariate(1/8)), 60)
+    gust = wind + rand.randint(5, 15) if wind > 10 and rand.random() < 0.4 else 0
+    direction = rand.randrange(10, 370, 10)
+    category = pick(rand, CATEGORY_WEIGHTS)
+    wx = pick(rand, WX_WEIGHTS)
+    visibility, lowest, highest = CATEGORY_WEATHER[category]
+    sky = [(rand.choice(["FEW", "SCT", "BKN", "OVC"]) if category == "VFR" else rand.choice(["BKN", "OVC"]),
+            rand.randrange(lowest, highest+1, 100))]
+    if rand.random() < NO_CATEGORY_RATE:
+        category = ''
+    text = time.strftime('%d%H%MZ', time.gmtime(obs_time))
+    raw = "%s %s %03d%02d%sKT 10SM %s A3000" % (station_id, text, direction, wind, 'G%02d' % gust if gust else '', wx)
+    return({'raw_text': ' '.join(raw.split()), 'station_id': station_id,
+            'observation_time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(obs_time)), 'obs_time': obs_time,
+            'latitude': lat, 'longitude': lon, 'wind_dir_degrees': direction, 'wind_speed_kt': wind,
+            'wind_gust_kt': gust, 'wx_string': wx, 'visibility_statute_mi': visibility, 'sky': sky,
+            'flight_category': category})
+
+
+def make_metars(ids, hours): # METARs for every hour within 'hours', newest first
+    now = time.time()
+    newest = int(now // 3600) * 3600 + 53*60 # METARs are made at 53 minutes past the hour
+    if newest > now:
+        newest -= 3600
+    obs_times = []
+    obs_time = newest
+    while obs_time > now - hours*60*60:
+        obs_times.append(obs_time)
+        obs_time -= 3600
+    return([make_metar(station_id, obs_time) for obs_time in obs_times for station_id in ids])
+
+
+def to_xml(metars):
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<response version="1.3">', '  <data num_results="%d">' % len(metars)]
+    for metar in metars:
+        lines.append('    <METAR>')
+        for field in ['raw_text', 'station_id', 'observation_time', 'latitude', 'longitude', 'wind_dir_degrees',
+                      'wind_speed_kt', 'wind_gust_kt', 'visibility_statute_mi', 'wx_string', 'sky', 'flight_category']:
+            if field == 'sky':
+                for cover, base in metar['sky']:
+                    lines.append('      <sky_condition sky_cover="%s" cloud_base_ft_agl="%d" />' % (cover, base))
+            elif metar[field] != '' and not (field == 'wind_gust_kt' and metar[field] == 0):
+                lines.append('      <%s>%s</%s>' % (field, metar[field], field))
+        lines.append('    </METAR>')
+    lines += ['  </data>', '</response>', '']
+    return('\n'.join(lines).encode())
+
+
+def to_json(metars):
+    return(json.dumps([{'icaoId': metar['station_id'], 'obsTime': metar['obs_time'], 'lat': metar['latitude'],
+                        'lon': metar['longitude'], 'wdir': metar['wind_dir_degrees'], 'wspd': metar['wind_speed_kt'],
+                        'wgst': metar['wind_gust_kt'] or None, 'wxString': metar['wx_string'] or None,
+                        'rawOb': metar['raw_text'], 'visib': metar['visibility_statute_mi'],
+                        'clouds': [{'cover': cover, 'base': base} for cover, base in metar['sky']],
+                        'fltCat': metar['flight_category'] or None} for metar in metars]).encode())
+
+
+def to_csv(metars):
+    fields = ['raw_text', 'station_id', 'observation_time', 'latitude', 'longitude', 'wind_dir_degrees',
+              'wind_speed_kt', 'wind_gust_kt', 'visibility_statute_mi', 'wx_string', 'flight_category']
+    lines = ['No errors', 'No warnings', '%d results' % len(metars), ','.join(fields + ['sky_cover', 'cloud_base_ft_agl'])]
+    for metar in metars:
+        cover, base = metar['sky'][0]
+        lines.append(','.join([str(metar[field]) for field in fields] + [cover, str(base)]))
+    return(('\n'.join(lines) + '\n').encode())
+
+
+FORMATS = {'xml': to_xml, 'json': to_json, 'csv': to_csv}
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, like the FAA
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        query = urllib.parse.parse_qs(url.query)
+        if url.path != '/api/data/metar':
+            self.send(404, b'Not Found')
+            return
+
+        time.sleep(latency + random.uniform(0, jitter))
+        if random.random() < fail_rate:
+            if random.random() < 0.5:
+                self.send(503, b'Service Unavailable')
+            else: # cut off without an answer
+                self.close_connection = True
+            return
+
+        ids = [station_id for station_id in query.get('ids', [''])[0].split(',') if station_id]
+        try:
+            hours = float(query.get('hours', ['1'])[0])
+        except ValueError:
+            hours = 1
+        metars = make_metars(ids, hours)
+        if not metars: # like the FAA when none of the airports have a METAR
+            self.send(204, b'')
+            return
+        to_format = FORMATS.get(query.get('format', ['xml'])[0], to_xml)
+        body = to_format(metars)
+
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.send(304, b'')
+            return
+        self.send(200, body, etag)
+
+    def send(self, status, body, etag=None):
+        self.send_response(status)
+        if body and 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body, 6)
+            self.send_header('Content-Encoding', 'gzip')
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): # don't log every request
+        pass
+
+
+def start(port=PORT): # Start the server in the background, returns it
+    global stations
+    stations = load_stations(STATION_FILE)
+    server = http.server.ThreadingHTTPServer(('', port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print("Fake FAA server on port %d, %.2f secs latency, %.2f secs jitter, %.0f%% failures" % \
+          (port, latency, jitter, fail_rate*100))
+    return(server)
+
+
+def load_test(count, port): # Fetch 'count' made up airports from the fake server and time it
+    import metar_fetch
+    from metar_table import make_table
+    metar_fetch.set_metar_url("http://localhost:%d/api/data/metar" % port)
+    ids = make_station_ids(count)
+    for run in range(2): # the second run asks for the same data, most of it should come back unchanged
+        start_time = time.time()
+        metars, stats = metar_fetch.fetch_metars(ids)
+        fetch_secs = time.time() - start_time
+        start_time = time.time()
+        make_table(metars)
+        print("%d of %d airports, %d chunks, %d failed, %.2f secs fetching, %.3f secs making table" % \
+              (len(metars), count, len(stats), len([stat for stat in stats if stat['error']]),
+               fetch_secs, time.time() - start_time))
+    total = metar_fetch.session.stats()
+    print("%d requests, %d handshakes, %d bytes on wire, %d bytes decoded" % \
+          (total['requests'], total['handshakes'], total['bytes_on_wire'], total['bytes_decoded']))
+
+
+if __name__ == "__main__":
+    port = PORT
+    test_count = 0
+    for arg in sys.argv[1:]:
+        var, val = arg.split("=")
+        if var == 'port':
+            port = int(val)
+        elif var == 'latency':
+            latency = float(val)
+        elif var == 'jitter':
+            jitter = float(val)
+        elif var == 'fail_rate':
+            fail_rate = float(val)
+        elif var == 'load_test':
+            test_count = int(val)
+
+    start(port)
+    if test_count:
+        load_test(test_count, port)
+    else:
+        while True:
+            time.sleep(60)
@@ -49,6 +49,24 @@
 # by state borders. The outline can be a simple box or most any shape defined by lon/lats for points.
 # This allows any geographic area such as one defined by a sectional, or even non-US territories to be used.
 #
+# The file 'metar_fetch.py' downloads the METAR data from the FAA. Airports are requested 300 at a time
+# and several of these chunks are requested at once. Each chunk is timed out and retried on its own.
+# Connections to the FAA are kept open and reused between updates, and the data is downloaded gzip'd.
+# The file 'metar_decode.py' decodes the data as it is downloaded into a compact record for each airport.
+# The file 'metar_cache.py' keeps each airport's METAR so states that share airports don't download them again.
+# The METARs are saved to 'metar_cache.bin' so they can be displayed right away after a reboot.
+# The file 'metar_refresh.py' downloads the METAR data in the background so a slow or missing internet
+# connection never freezes the display. The display always draws the latest data that has been downloaded.
+# The file 'network_monitor.py' watches for the network in the background and remembers the RPi's IP address.
+# The file 'metar_table.py' holds the displayed airports as NumPy columns for the lightning and high wind effects.
+# The file 'metar_history.py' remembers the last few hours of each airport's weather, from the data already downloaded.
+# The file 'station_db.py' builds 'stations.bin', where every airport is, so airports can be drawn before their METAR comes in.
+# The file 'metar_bench.py' compares how fast the xml, json and csv METAR formats decode on the RPi. See 'metar_format'.
+# The file 'metar_replay.py' saves the FAA's responses and plays them back. See 'record_metars' and 'replay_metars'.
+# The file 'fake_faa.py' is a stand-in for the FAA's server with made up METARs, for testing without the internet. See 'metar_url'.
+# The file 'outline_store.py' packs the outlines of the states and USA into 'outlines.bin', built when first needed.
+# The file 'outline_cache.py' keeps each state's outline drawn into an image so it is only drawn once. See 'outline_cache'.
+#
 # Command line variables can be passed to tweak the behavior of the program.
 # Example: 'sudo python3 ledmap.py interval=120 use_wipe=0 time_display=0'
 # This command will run the software with 2 min intervals between updates with no wipes and no clock
@@ -73,6 +91,14 @@
 #    big_ltng_flash = 1    # 1 use large lightning flash, 0 use single pixel
 #    ltng_flash_size = 3   # Size of flash, larger is bigger.
 #    single_state = "UTAH" # Default Single State to display for 'state_single_0' in file 'state_lists.py'
+#    cache_ttl = 300       # Seconds to reuse an airport's METAR before getting it again from the FAA
+#    bulk_snapshot = 0     # 1 = get every map's airports at once each interval, so switching states needs no download
+#    metar_format = "xml"  # Format to get the METAR data in, "xml", "json" or "csv". See metar_bench.py
+#    record_metars = ""    # Folder to save every response from the FAA in, "" = don't save. See metar_replay.py
+#    replay_metars = ""    # Folder of saved responses to display instead of downloading, "" = download
+#    replay_speed = 1      # 1 = replay in real time, 60 = an hour a minute, 0 = as fast as it can
+#    metar_url = ""        # Server to get the METAR data from, "" = the FAA. See fake_faa.py
+#    outline_cache = ""    # Folder to save the drawn outlines in so they aren't drawn again after a reboot, "" = don't save
 #
 # This software uses flask to create a web admin page that will control the behavior for the display.
 # To access the admin page enter the IP address for the RPi and append ':5000' to it.
@@ -83,23 +109,30 @@
 #######################
 # Import Dependencies #
 #######################
-import json
 import time
 from datetime import datetime
 from datetime import time as time_
-import string
 import sys
 import os
 import random
-import socket
+import threading
 import flask                       # sudo apt install python3-flask
-import xml.etree.ElementTree as ET
-import urllib.request, urllib.error, urllib.parse
+import numpy as np                 # sudo apt install python3-numpy
 from state_ap_dict import *        # dict that lists each state and airport with metars
 from scalebystate import *         # dict that allows custom scaling of each state into display window
 from state_lists import *          # get the list of states to display
 from custom_layout import *        # get custom area info
 from usa_ap_dict import *          # get USA airports to display
+from metar_cache import station_cache # reuse recent METAR data, see 'cache_ttl'
+import metar_fetch                 # get METAR data from the FAA, see 'metar_format'
+from metar_refresh import MetarRefresher # get METAR data from the FAA in the background
+from metar_replay import MetarReplayer   # or play back saved data, see 'replay_metars'
+from metar_decode import metar_changed, CATEGORIES, WX_LIGHTNING # tell if an airport needs to be redrawn, categories, weather flags
+from network_monitor import NetworkMonitor # check for the network without waiting on it
+from metar_table import make_table # columns of METAR data for the effects
+from station_db import load_stations, STATION_FILE # where every airport is, see 'stations.bin'
+from outline_store import OutlineStore, group_bounds, merge_bounds, simplify # outlines of the states and USA
+from outline_cache import LayerCache # outlines already drawn into images
 from rgbmatrix import RGBMatrix, RGBMatrixOptions, graphics
 from PIL import Image
 from PIL import ImageDraw
@@ -125,7 +158,7 @@ TOTAL_Y = DISPLAY_Y * PARALLEL
 #####################
 # Edit these to provide a default starting point. These are altered by the web interface 
 outline = 1           # Show outline of state or not. 1=Yes, 0=No
-point_or_line = 1     # 0 = uses points, 1 = uses lines to draw outline of state. See NUM_STEPS below
+point_or_line = 1     # 0 = uses points, 1 = uses lines to draw outline of state. See SIMPLIFY_PIXELS below
 metar_age = "2.5"     # dictates how old the returned metars can be 2.5 hours is typical
 delay = .0001          # delay for painting pixels in wipes
 interval = 5 * 60     # 1 min * 60 seconds, how long before switching to next state and updating FAA metar data
@@ -147,17 +180,27 @@ toggle_sec = 1        # 1 = yes, 0 = no, this toggles border to signify seconds
 big_ltng_flash = 1    # 1 use large lightning flash, 0 use single pixel
 ltng_flash_size = 3   # Size of flash, larger is bigger.
 single_state = "UTAH" # Default Single State to display for 'state_single_0' in file 'state_lists.py'
+cache_ttl = 5 * 60    # seconds to reuse an airport's METAR before getting it again from the FAA
+bulk_snapshot = 0     # 1 = get every map's airports at once each interval, 0 = get each map's airports when displayed
+metar_format = "xml"  # "xml", "json" or "csv", the format to get the METAR data in from the FAA
+record_metars = ""    # folder to save every response from the FAA in, "" = don't save them
+replay_metars = ""    # folder of saved responses to display instead of downloading, "" = download from the FAA
+replay_speed = 1      # 1 = replay in real time, 60 = an hour a minute, 0 = as fast as it can
+metar_url = ""        # "" = the FAA, or a test server i.e. "http://localhost:8080/api/data/metar", see fake_faa.py
+outline_cache = ""    # folder to save the drawn outlines in, "" = only keep them in memory, see outline_cache.py
 
 # Initiate Lists and Dictonaries
-flat_lonlat = [] 
-flat_lat = []
-flat_lon = []
 rand_list = []        # list to create random list of display pixels for wipe
 info = []
-ap_ltng_dict = {}     # capture airports reporting Tstorms and lightning in dictionary
-ap_snow_dict = {}     # capture airports reporting snow in dictionary
-ap_rain_dict = {}     # capture airports reporting rain in dictionary
-ap_wind_dict = {}     # capture airports whose winds are higher than max_windspeedkt
+wx_table = make_table({}) # lat/lon, category, winds and weather of the displayed airports, see metar_table.py
+metars = {}           # latest METAR record for each airport, see metar_decode.py
+refresh_states = []   # states whose airports the background refresh keeps up to date, see refresh_airports()
+drawn_snapshot_time = 0 # time of the snapshot currently drawn on the display
+current_view = None   # outline and screen boundaries of the state being displayed, see load_view()
+prerendered = {}      # state : (view, image, metars, snapshot time) rendered before the state is displayed
+outline_pixels = {}   # outline key : pixel positions of each group of the outline, see outline_points()
+stations = {}         # station_id : Station, lat/lon of airports before their METAR comes in, see station_db.py
+base_frame = None     # image of the outline and airports on the display, used to undo the effects, see show_frame()
 
 #LED Cycle times - Controls blink rates. Can change if necessary.
 cycle0_wait = .9      # These cycle times all added together will equal the total amount of time
@@ -188,10 +231,12 @@ matrix = RGBMatrix(options=options)
 #############
 PATH = '/home/pi/ledmap/'
 MULT = 1          # Default=1. Increasing will increase size of image displayed.
-X_OFFSET = []    
-Y_OFFSET = []    
-NUM_STEPS = 1     # Adjust the resolution of the outline of the state. 1 is best, but slowest
+SIMPLIFY_PIXELS = 0.5 # Adjust the resolution of the outline of the state. Points closer than this many pixels
+                      # to the line between their neighbours aren't drawn. 0 draws every point, but slowest
 HIWINDS_BLINK = 1 # Seconds to blink the high winds airports
+CACHE_FILE = 'metar_cache.bin' # METARs are saved here so they can be displayed right away after a reboot
+outlines = OutlineStore(PATH) # outlines of the states, USA and custom map, see 'outlines.bin'
+outline_layers = LayerCache() # outlines drawn into images, see 'outline_cache'
 
 RED = (255, 0, 0)       # used to denote IFR flight category
 GREEN = (0, 200, 0)     # used to denote VFR flight category
@@ -211,18 +256,8 @@ clock_border_color = (0,0,235) # dimmer blue used when clock only is displayed
 clear_toggle = 1
 
 # Weather Designators used in Metars
-# Thunderstorm and lightning METAR weather description codes that denote lightning in the area.
-wx_lghtn_ck = ["TS", "TSRA", "TSGR", "+TSRA", "TSRG", "FC", "SQ", "VCTS", "VCTSRA", "VCTSDZ", "LTG"]
-#Snow in various forms
-wx_snow_ck = ["BLSN", "DRSN", "-RASN", "RASN", "+RASN", "-SN", "SN", "+SN", "SG", "IC", "PE", "PL", "-SHRASN", "SHRASN", "+SHRASN", "-SHSN", "SHSN", "+SHSN"]
-#Rain in various forms
-wx_rain_ck = ["-DZ", "DZ", "+DZ", "-DZRA", "DZRA", "-RA", "RA", "+RA", "-SHRA", "SHRA", "+SHRA", "VIRGA", "VCSH"]
-#Freezing Rain
-wx_frrain_ck = ["-FZDZ", "FZDZ", "+FZDZ", "-FZRA", "FZRA", "+FZRA"]
-#Dust Sand and/or Ash
-wx_dustsandash_ck = ["DU", "SA", "HZ", "FU", "VA", "BLDU", "BLSA", "PO", "VCSS", "SS", "+SS",]
-#Fog
-wx_fog_ck = ["BR", "MIFG", "VCFG", "BCFG", "PRFG", "FG", "FZFG"]
+# Lightning, snow, rain, freezing rain, dust/sand/ash and fog are picked out of each METAR's
+# weather string as it is decoded. See the WX_ codes in 'metar_decode.py' to change them.
 
 # Create as many lists of states to display and store them in 'state_lists.py' and add name to list
 state_list = [state_single_0,state_misc_1,state_complete_2,state_northeast_3,state_southeast_4,\
@@ -304,7 +339,8 @@ variables = ['outline','point_or_line','metar_age','delay','interval','use_wipe'
              'show_title','ltng_brightness','hiwind_brightness','default_brightness',\
              'clock_brightness','max_windspeedkt','state_list_to_use','time_display',\
              'display_lightning','display_hiwinds','hiwinds_single','clock_only','big_ltng_flash',\
-             'ltng_flash_size','single_state']
+             'ltng_flash_size','single_state','cache_ttl','bulk_snapshot','metar_format',\
+             'record_metars','replay_metars','replay_speed','metar_url','outline_cache']
 
 if len(sys.argv) > 1: # Grab cmdline variables and assign them properly
     print(sys.argv) # debug
@@ -362,6 +398,22 @@ if len(sys.argv) > 1: # Grab cmdline variables and assign them properly
                     ltng_flash_size = int(val)
                 elif var == 'single_state':
                     single_state = val # keep this in string format
+                elif var == 'cache_ttl':
+                    cache_ttl = int(val)
+                elif var == 'bulk_snapshot':
+                    bulk_snapshot = int(val)
+                elif var == 'metar_format':
+                    metar_format = val # keep this in string format
+                elif var == 'record_metars':
+                    record_metars = val # keep this in string format
+                elif var == 'replay_metars':
+                    replay_metars = val # keep this in string format
+                elif var == 'replay_speed':
+                    replay_speed = float(val)
+                elif var == 'metar_url':
+                    metar_url = val # keep this in string format
+                elif var == 'outline_cache':
+                    outline_cache = val # keep this in string format
 
     if state_list_to_use == state_list[0]: # Reassign State Name from web admin page
         state_list_to_use[0] = single_state
@@ -370,6 +422,15 @@ if len(sys.argv) > 1: # Grab cmdline variables and assign them properly
 else:
     print("No cmd line variables, using default values from ledmap.py")
 
+station_cache.ttl = cache_ttl
+metar_fetch.metar_format = metar_format
+if record_metars:
+    metar_fetch.record_dir = PATH+record_metars
+if metar_url:
+    metar_fetch.set_metar_url(metar_url)
+if outline_cache:
+    outline_layers.folder = PATH+outline_cache
+
 
 #############
 # Functions #
@@ -429,21 +490,8 @@ def time_in_range(start, end, x): # See if a time falls within a range
         return start <= x or x <= end
     
     
-def get_ip_address(): # Get RPi IP address to display on start-up.
-    ip_address = ''
-    counter = 10
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    
-    while counter >= 0:
-        try:
-            s.connect(("8.8.8.8",80))
-            ip_address = s.getsockname()[0]
-            s.close()
-        #    print("Admin IP:",ip_address) # debug
-            return ip_address
-        except:
-            counter -= 1
-            time.sleep(10) # if internet not available, wait 10 secs and try again up to 10 times.
+def get_ip_address(): # Get RPi IP address to display on start-up. See network_monitor.py
+    return(network.ip_address) # '' if the network has not come up yet
 
 
 def clock():
@@ -524,6 +572,7 @@ def rand(range_low, range_high): # Generate random int between 2 values for wipe
 
 
 def create_rand(x,y): # Create list of rand (x,y) tuples for wipes
+    rand_list.clear()
     for i in range(1,y):
         for j in range(1,x):
             rand_list.append((random.randint(0,x),random.randint(0,y)))
@@ -686,275 +735,155 @@ def wipe5(iteration, animate=1):
                     matrix.SetPixel(x,y,r,g,b)
         
 
-def convert_latlon(lat,lon): # Convert lat/lon into screen coordinates
+def project(lat,lon,view=None): # Convert arrays of lat/lon into arrays of pixel positions all at once
     # https://stackoverflow.com/questions/59554125/how-to-convert-lat-lon-coordinates-to-coordinates-of-tkinter-canvas
-    global maxlat, minlat, maxlon, minlon
-    adj_maxlat = maxlat + Y_OFFSET 
-    adj_minlat = minlat - Y_OFFSET
-    adj_maxlon = maxlon + X_OFFSET
-    adj_minlon = minlon - X_OFFSET
-    x = int((lon - adj_minlon) * TOTAL_X / (adj_maxlon - adj_minlon))
-    y = int(TOTAL_Y-(lat - adj_minlat) * TOTAL_Y / (adj_maxlat - adj_minlat)) # remove 'DISPLAY_Y-(' to invert Y axis
-    return(x,y)
+    if view is None: # use the state being displayed
+        view = current_view
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    x = ((lon - view['adj_minlon']) * TOTAL_X / (view['adj_maxlon'] - view['adj_minlon'])).astype(np.int32)
+    y = (TOTAL_Y-(lat - view['adj_minlat']) * TOTAL_Y / (view['adj_maxlat'] - view['adj_minlat'])).astype(np.int32) # remove 'TOTAL_Y-(' to invert Y axis
+    return(x*MULT, y*MULT)
 
-     
-def read_file(state):
-    # Opening JSON file
-    # List found at https://web.archive.org/web/20130615162524/http://eric.clst.org/wupl/Stuff/gz_2010_us_040_00_500k.json
-    f = open(PATH+'statelatlon.json.txt') # statelatlon.json.txt list stored locally
-    data = json.load(f) # returns JSON object as a dictionary
-    f.close() # Closing file
-    return(data)
-
-
-def draw_outline(state,use_cache=0): # 0 = read file to data, 1 = use cached data
-    global coords, group
-    global NUM_STEPS
-    global maxlat, minlat, maxlon, minlon
-    k = 0
-    data = read_file("state") # Read Json file
-
-    if STATE != "ALL50":
-        if use_wipe:
-            wipe4(1)
 
-    if use_cache == 0:
-        for i in data['features']:
-            name = i['properties']['NAME'] # State name
+def project_group(group,view=None): # Pixel positions of a whole group of [lon, lat] coordinates at once, see project()
+    x, y = project(group[:,1], group[:,0], view) # group is an array, see outline_store.py
+    return(list(zip(x.tolist(), y.tolist())))
 
-            if name == state: # or state == "Usa": # name Choose which state to grab
-                print("\nDisplaying:",name)
-                coords = i['geometry']['coordinates'] # grab all the groups of coordinates
-                
-                for j in range(len(coords)): # iterate through each group                
-                    # Flaten groups into 1 level to get min and max lat/lon
-                    if len(coords) != 1:
-                        for group in coords[j]: # iterate through each coord in the group
-                            for coord in group: # flatten list of coords to get min and max values
-                                flat_lonlat.append(coord)
-                                flat_lon.append(coord[0])
-                                flat_lat.append(coord[1])
-                    else:
-                        for group in coords[j]: # iterate through each coord in the group
-                            flat_lonlat.append(group)
-                            flat_lon.append(group[0])
-                            flat_lat.append(group[1])
-                            
-                # Create imaginary box/display using the max and mins of the state's coordinates
-                maxlat = max(flat_lat)
-                minlat = min(flat_lat)
-                maxlon = max(flat_lon)
-                minlon = min(flat_lon)
-                upper_left = [maxlat,minlon]
-                lower_right = [minlat,maxlon]
-
-    # Plot outline of STATE - Using groups of lists
-    if outline == 1:
-        if STATE != "ALL50":
-            clear(BLACK)
-            
-#        print("---> Number of Lat/Lon Groups:",len(coords))
-        if len(coords) > 1: # For states with multiple discontiguous areas
-            for l in range(len(coords)):
-                group = coords[l][0]
-                
-                for k in range(0,len(group), NUM_STEPS): # Skipping every 10 coords
-                    item = group[k]
-                    x_unit,y_unit = convert_latlon(item[1], item[0]) # item[0]=lon, item[1]=lat
-                    pos = (x_unit*MULT, y_unit*MULT) # *MULT
-                    pos1 = pos
-                    
-                    if k == 0:
-                        pos2 = pos
-                        pos0 = pos
-                    
-                    r,g,b = state_color
-                    stcolor = graphics.Color(r,g,b)
-                    
-                    if point_or_line == 0: # draw state using points or lines
-                        matrix.SetPixel(pos[0],pos[1],r,g,b) # matrix.SetPixel(i,j,0,0,255) (x,y,R,G,B)
-                    else:
-                        if use_cache == 0:
-                            graphics.DrawLine(matrix, pos1[0], pos1[1], pos2[0], pos2[1], stcolor)
-                        graphics.DrawLine(offscreen_canvas, pos1[0], pos1[1], pos2[0], pos2[1], stcolor)
-                        graphics.DrawLine(offscreen_canvas1, pos1[0], pos1[1], pos2[0], pos2[1], stcolor)
-                        if k > len(group) - NUM_STEPS:
-                            if use_cache == 0:
-                                graphics.DrawLine(matrix, pos2[0], pos2[1], pos0[0], pos0[1], stcolor)
-                            graphics.DrawLine(offscreen_canvas, pos2[0], pos2[1], pos0[0], pos0[1], stcolor)
-                            graphics.DrawLine(offscreen_canvas1, pos2[0], pos2[1], pos0[0], pos0[1], stcolor)
-                        pos2 = pos1
-                        
-        else: # For states with one contiguous area
-            for j in range(0,len(flat_lonlat), NUM_STEPS): # Skipping every 10 coords
-                item = flat_lonlat[j]
-                x_unit,y_unit = convert_latlon(item[1], item[0]) # item[0]=lon, item[1]=lat
-                pos = (x_unit*MULT, y_unit*MULT)
-                pos1 = pos
-                
-                if j == 0:
-                    pos2 = pos
-                    pos0 = pos
+     
+def continental(group): # Isolate just the continental US.
+    outside = (group[:,0] > 0) | (group[:,0] < -125) | (group[:,1] < 20) # group is an array of lon/lat, see outline_store.py
+    if outside.any():
+        return(group[:outside.argmax()]) # up to the first point outside
+    return(group)
 
-                r,g,b = state_color
-                stcolor = graphics.Color(r,g,b)
-                
-                if point_or_line == 0:
-                    matrix.SetPixel(pos[0],pos[1],r,g,b) # matrix.SetPixel(i,j,0,0,255) (x,y,R,G,B)
-                else:
-                    if use_cache == 0:
-                        graphics.DrawLine(matrix, pos1[0], pos1[1], pos2[0], pos2[1], stcolor)
-                    graphics.DrawLine(offscreen_canvas, pos1[0], pos1[1], pos2[0], pos2[1], stcolor)
-                    graphics.DrawLine(offscreen_canvas1, pos1[0], pos1[1], pos2[0], pos2[1], stcolor)
-                    if k > len(group) - NUM_STEPS:
-                        if use_cache == 0:
-                            graphics.DrawLine(matrix, pos2[0], pos2[1], pos0[0], pos0[1], stcolor)
-                        graphics.DrawLine(offscreen_canvas, pos2[0], pos2[1], pos0[0], pos0[1], stcolor)
-                        graphics.DrawLine(offscreen_canvas1, pos2[0], pos2[1], pos0[0], pos0[1], stcolor)
-                    pos2 = pos1
-                        
-
-# Routine to draw outline of USA
-def draw_usa(use_cache=0): # 0 = read file to data, 1 = use cached data.
-    global NUM_STEPS, data
-    global maxlat, minlat, maxlon, minlon
-    lat, lon = 0,0
-    name = "USA"
-    
-    if STATE != "ALL50":
-        if use_wipe:
-            wipe4(1)
-    
-    if use_cache == 0:
-        f = open(PATH+'gz_2010_us_outline_20m.json') # usa.json.txt list stored locally
-        data = json.load(f) # returns JSON object as a dictionary
-        f.close() # Closing file
 
-        print("\nDisplaying:",name)
-        for i in range(len(data['features'])):
+def get_scale(state): # Offsets used to adjust image on screen in the X and Y axis
+    if TOTAL_X != TOTAL_Y: # Rectangular Display Scaling
+        scale_list = scalebystate_rect.get(state) # Scale states for Rectangular displays, 64x32 LED Matrix
+    else: # Square Display Scaling
+        scale_list = scalebystate_square.get(state) # Scale states for Square displays, 64x64 LED Matrix
+    return(scale_list[0], scale_list[1])
 
-            coords = data['features'][i]['geometry']['coordinates'] # grab all the groups of coordinates
-            
-            for j in range(len(coords)): # iterate through each group
-                lon,lat = coords[j] # iterate through each coord in the group
-                if lon > 0 or lon < -125 or lat < 20: # Isolate just the continental US.
-                    break
-                flat_lonlat.append(coords[j])
-                flat_lon.append(lon)
-                flat_lat.append(lat)
-                        
-            # Create imaginary box/display using the max and mins of the state's coordinates
-            maxlat = max(flat_lat)
-            minlat = min(flat_lat)
-            maxlon = max(flat_lon)
-            minlon = min(flat_lon)
-            upper_left = [maxlat,minlon]
-            lower_right = [minlat,maxlon]
-        print("---> Max Lat:",maxlat,"Min Lat:",minlat,"Max Lon:",maxlon,"Min Lon:",minlon)
-
-    # Plot outline of USA - Using groups of lists
-    if outline == 1:
-        if STATE != "ALL50":
-            clear(BLACK)
-        
-        for i in range(len(data['features'])):
-            coords = data['features'][i]['geometry']['coordinates'] # grab all the groups of coordinates
 
-            for j in range(len(coords)): # iterate through each group
-                lon,lat = coords[j]
-#                print(type(lat),lon) # debug
+def airport_state(state): # Name of the map whose airports are displayed for a state
+    if state == "ALL50":
+        return("USA")
+    elif state == "WASHINGTON D.C.": # washington d.c. is displayed as maryland
+        return("MARYLAND")
+    return(state)
 
-                x_unit,y_unit = convert_latlon(lat, lon) # lat, lon
-                pos = (x_unit*MULT, y_unit*MULT) # *MULT
-                pos1 = pos
-                
-                if j == 0:
-                    pos2 = pos
-                    pos0 = pos
-                    
-                r,g,b = state_color
-                stcolor = graphics.Color(r,g,b)
-                
-                if point_or_line == 0: # draw state using points or lines
-                    matrix.SetPixel(pos[0],pos[1],r,g,b) # matrix.SetPixel(i,j,0,0,255) (x,y,R,G,B)
-                else:
-                    if use_cache == 0:
-                        graphics.DrawLine(matrix, pos1[0], pos1[1], pos2[0], pos2[1], stcolor)
-                    graphics.DrawLine(offscreen_canvas, pos1[0], pos1[1], pos2[0], pos2[1], stcolor)
-                    graphics.DrawLine(offscreen_canvas1, pos1[0], pos1[1], pos2[0], pos2[1], stcolor)
-
-                    if j > len(coords) - NUM_STEPS:
-                        if use_cache == 0:
-                            graphics.DrawLine(matrix, pos2[0], pos2[1], pos0[0], pos0[1], stcolor)
-                        graphics.DrawLine(offscreen_canvas, pos2[0], pos2[1], pos0[0], pos0[1], stcolor)
-                        graphics.DrawLine(offscreen_canvas1, pos2[0], pos2[1], pos0[0], pos0[1], stcolor)
-                    pos2 = pos1
-
-
-# Routine to draw outline of custom area, data located in custom_layout.py
-def draw_custom(use_cache=0): # 0 = read file to data, 1 = use cached data.
-    global NUM_STEPS
-    global maxlat, minlat, maxlon, minlon
-    lat, lon = 0,0
-    name = custom_layout_dict['custom_name']
-    
-    if STATE != "ALL50":
-        if use_wipe:
-            wipe4(1)
-    
-    print("\nDisplaying:",name)    
-    coords = custom_layout_dict['custom_outline'] # grab all the groups of coordinates
-#    print(coords) # debug
-        
-    for j in range(len(coords)): # iterate through each group
-        lon,lat = coords[j] # iterate through each coord in the group
-        flat_lonlat.append(coords[j])
-        flat_lon.append(lon)
-        flat_lat.append(lat)
-                    
-        # Create imaginary box/display using the max and mins of the state's coordinates
-        maxlat = max(flat_lat)
-        minlat = min(flat_lat)
-        maxlon = max(flat_lon)
-        minlon = min(flat_lon)
-        upper_left = [maxlat,minlon]
-        lower_right = [minlat,maxlon]
-#    print("---> Max Lat:",maxlat,"Min Lat:",minlat,"Max Lon:",maxlon,"Min Lon:",minlon)
-
-    # Plot outline of custom layout
-    if outline == 1:
-        if STATE != "ALL50":
-            clear(BLACK)
-            
-        for j in range(len(coords)): # iterate through each group
-            lon,lat = coords[j]
-#            print(type(lat),lon) # debug
 
-            x_unit,y_unit = convert_latlon(lat, lon) # lat, lon
-            pos = (x_unit*MULT, y_unit*MULT) # *MULT
-            pos1 = pos
-            
-            if j == 0:
-                pos2 = pos
-                pos0 = pos
-                
-            r,g,b = state_color
-            stcolor = graphics.Color(r,g,b)
-            
-            if point_or_line == 0: # draw state using points or lines
-                matrix.SetPixel(pos[0],pos[1],r,g,b) # matrix.SetPixel(i,j,0,0,255) (x,y,R,G,B)
+def display_name(state): # Name logged when a state, USA, custom area or all 50 states is displayed
+    if state == "CUSTOM":
+        return(custom_layout_dict['custom_name'])
+    elif state == "ALL50":
+        return("USA")
+    return(airport_state(state))
+
+
+def load_view(state): # Outline, airports and screen boundaries of a state, USA, custom area or all 50 states
+    # Outlines are memory mapped from 'outlines.bin', see outline_store.py
+    if state == "USA" or state == "ALL50":
+        groups = outlines.usa()
+        bounds = group_bounds([continental(group) for group in groups])
+        if state == "ALL50": # Setup the screen to accommodate all 50 states
+            for other in ["ALASKA", "HAWAII"]:
+                groups = groups + outlines.state(other)
+                bounds = merge_bounds(bounds, outlines.state_bounds(other))
+    elif state == "CUSTOM":
+        groups = outlines.custom()
+        bounds = group_bounds(groups)
+    else:
+        groups = outlines.state(airport_state(state))
+        bounds = outlines.state_bounds(airport_state(state))
+
+    # Create imaginary box/display using the max and mins of the state's coordinates
+    minlon, minlat, maxlon, maxlat = bounds
+    x_offset, y_offset = get_scale(state)
+    return({'state': state, 'groups': groups, 'airports': get_airports(airport_state(state)),
+            'maxlat': maxlat, 'minlat': minlat, 'maxlon': maxlon, 'minlon': minlon,
+            'x_offset': x_offset, 'y_offset': y_offset,
+            # boundaries adjusted by the offsets, used by project()
+            'adj_maxlat': maxlat + y_offset, 'adj_minlat': minlat - y_offset,
+            'adj_maxlon': maxlon + x_offset, 'adj_minlon': minlon - x_offset})
+
+
+def outline_key(view): # Everything that changes how a state's outline is drawn, see outline_cache.py
+    return((view['state'], TOTAL_X, TOTAL_Y, MULT, view['x_offset'], view['y_offset'],
+            view['adj_minlon'], view['adj_minlat'], view['adj_maxlon'], view['adj_maxlat'],
+            outline, point_or_line, SIMPLIFY_PIXELS, state_color, outlines.built))
+
+
+def outline_points(view): # Pixel positions of each group of the outline, leaving out points that can't be seen
+    # Worked out once for each state and display size, see outline_key()
+    key = outline_key(view)
+    if key in outline_pixels:
+        return(outline_pixels[key])
+
+    # Pixels per degree of lon and lat on this display, so the tolerance is in pixels
+    scale = np.array([TOTAL_X / (view['adj_maxlon'] - view['adj_minlon']),
+                      TOTAL_Y / (view['adj_maxlat'] - view['adj_minlat'])]) * MULT
+    groups = []
+    for group in view['groups']:
+        if point_or_line == 1: # points are drawn on their own so none can be left out
+            group = simplify(group, SIMPLIFY_PIXELS, scale)
+        points = project_group(group, view)
+        # drop points that land on the same pixel as the one before
+        groups.append(points[:1] + [point for last, point in zip(points, points[1:]) if point != last])
+    outline_pixels[key] = groups
+    return(groups)
+
+
+def outline_layer(view): # Image of a state's outline, only drawn the first time it is needed
+    key = outline_key(view)
+    image = outline_layers.get(key)
+    if image is not None:
+        return(image)
+
+    image = Image.new('RGB', (TOTAL_X, TOTAL_Y))
+    draw = ImageDraw.Draw(image)
+    if outline == 1: # Plot outline of state - Using groups of lists
+        for points in outline_points(view):
+            # Groups are drawn as they are stored, state rings already end on their first point and
+            # the lines in the USA outline are left open
+            if point_or_line == 0 or len(points) == 1: # draw state using points or lines
+                draw.point(points, fill=state_color)
             else:
-                if use_cache == 0:
-                    graphics.DrawLine(matrix, pos1[0], pos1[1], pos2[0], pos2[1], stcolor)
-                graphics.DrawLine(offscreen_canvas, pos1[0], pos1[1], pos2[0], pos2[1], stcolor)
-                graphics.DrawLine(offscreen_canvas1, pos1[0], pos1[1], pos2[0], pos2[1], stcolor)
+                draw.line(points, fill=state_color)
+    outline_layers.put(key, image)
+    return(image)
+
+
+def render_view(view, metars): # Draw outline and airports into an image, so the display can switch to it at once
+    image = outline_layer(view).copy() # the cached outline is never drawn on
+    draw = ImageDraw.Draw(image)
 
-                if j > len(coords) - NUM_STEPS:
-                    if use_cache == 0:
-                        graphics.DrawLine(matrix, pos2[0], pos2[1], pos0[0], pos0[1], stcolor)
-                    graphics.DrawLine(offscreen_canvas, pos2[0], pos2[1], pos0[0], pos0[1], stcolor)
-                    graphics.DrawLine(offscreen_canvas1, pos2[0], pos2[1], pos0[0], pos0[1], stcolor)
-                pos2 = pos1
+    table = make_table(metars, view['airports'], stations) # airports with no METAR are drawn as "NONE"
+    x, y = project(table['lat'], table['lon'], view)
+    for pos1, pos2, category in zip(x.tolist(), y.tolist(), table['category'].tolist()): # Draw airport flight categories on top of outline
+        draw.point((pos1, pos2), fill=get_fc_color(CATEGORIES[category]))
+    return(image)
+
+
+def prerender(state, asked_time): # Get the next state ready while the current state is displayed
+    # Wait for the refresh asked for when the current state came up, it downloads the next state's airports too.
+    # It may not publish anything if nothing changed, so wait for it to finish, not for a new snapshot
+    refresher.wait_refreshed(asked_time, interval/2)
+
+    snapshot, snapshot_time = refresher.published # read once, the refresh may swap in a new one at any time
+    view = load_view(state)
+    metars = slice_snapshot(snapshot, view['airports'])
+    prerendered[state] = (view, render_view(view, metars), metars, snapshot_time)
+
+
+def show_frame(image): # Switch the display to a rendered image with one swap
+    global offscreen_canvas, base_frame
+    base_frame = image # kept up to date by draw_apwx() as new data comes in
+    offscreen_canvas.SetImage(image)
+    offscreen_canvas = matrix.SwapOnVSync(offscreen_canvas)
+    offscreen_canvas.SetImage(image) # copy display to offscreen frames used by the effects
+    offscreen_canvas1.SetImage(image)
 
 
 def get_fc_color(flightcategory):
@@ -971,203 +900,123 @@ def get_fc_color(flightcategory):
     return(color)
 
 
-def draw_apwx(STATE, use_cache=0): # draw airport weather flight category, 0 = get new data online
-    global root # temp test
+def get_airports(state): # Airports to display for a state, USA or custom map
+    if state == "CUSTOM":
+        return(custom_layout_dict['airports'])
+    elif state == "USA":
+        return(usa_ap_dict['USA'])
+    else:
+        return(state_ap_dict[state.upper()])
+
+
+def all_airports(): # Every airport that any map can display, used by 'bulk_snapshot'
+    airports = dict.fromkeys(ap_3000_dict['USA']) # dict keeps order and drops duplicates
+    airports.update(dict.fromkeys(usa_ap_dict['USA']))
+    for state in state_ap_dict:
+        airports.update(dict.fromkeys(state_ap_dict[state]))
+    airports.update(dict.fromkeys(custom_layout_dict['airports']))
+    return(list(airports))
+
+
+def log_ip_address(): # log IP address when ever FAA weather update is retreived.
+    if network.online:
+        print('RPI IP Address = ' + network.ip_address)
+    else:
+        print('Internet Not Available')
+
+
+def refresh_airports(): # Airports for the background refresh to download, see metar_refresh.py
+    log_ip_address()
+    if bulk_snapshot: # Every map is served from one download
+        return(all_airports())
+
+    airports = [] # the state being displayed and the next one
+    for state in refresh_states:
+        airports.extend(get_airports(airport_state(state)))
+    return(airports)
+
+
+def slice_snapshot(snapshot, airports): # Pull the METARs for one map out of the snapshot, no download needed
+    return({airport: snapshot[airport] for airport in airports if airport in snapshot})
+
+
+def load_apwx(new_metars, snapshot_time): # Use new METAR data for the displayed map
+    global metars, drawn_snapshot_time, wx_table
+    metars = new_metars
+    drawn_snapshot_time = snapshot_time
+    if len(metars) == 0:
+        print('METAR Data is Not Available Yet')
+
+    # Rebuild the table of airports for the effects from the new data, with each airport's pixel position
+    wx_table = make_table(metars, current_view['airports'], stations)
+    wx_table['x'], wx_table['y'] = project(wx_table['lat'], wx_table['lon'])
+
+
+def wx_airports(flag): # Airports in wx_table reporting the weather in 'flag', i.e. WX_LIGHTNING
+    return(wx_table[(wx_table['wx'] & flag) != 0])
+
+
+def hiwind_airports(): # Airports in wx_table whose winds are higher than max_windspeedkt
+    return(wx_table[wx_table['wind'] >= max_windspeedkt])
+
+
+def restore_base_frame(): # Put the outline and airports back on the display and offscreen frames in one copy each
+    matrix.SetImage(base_frame)
+    offscreen_canvas.SetImage(base_frame)
+    offscreen_canvas1.SetImage(base_frame)
+
+
+def draw_apwx(STATE, use_cache=0): # draw airport weather flight category, 0 = get new data
     global clear_toggle
+    if use_cache == 1 and base_frame is not None: # nothing new, just undo the effects
+        restore_base_frame()
+        return
+
     if use_cache == 0:
-        # Define URL to get weather METARS. If no METAR reported withing the last 2.5 hours, Airport LED will be white (nowx).
-#        url = "https://aviationweather.gov/api/data/dataserver?requestType=retrieve&dataSource=metars&format=xml&mostRecent=true&mostRecentForEachStation=constraint&hoursBeforeNow="+str(metar_age)+"&stationString="
-#        url = "https://aviationweather-cprk.ncep.noaa.gov/adds/dataserver_current/httpparam?dataSource=metars&requestType=retrieve&format=xml&mostRecentForEachStation=constraint&hoursBeforeNow="+str(metar_age)+"&stationString="
-        url = "https://aviationweather.gov/api/data/metar?format=xml&hours=" +str(metar_age)+ "&ids="
+        # Get weather METARS from the latest snapshot downloaded in the background, this never waits on the FAA.
+        # If no METAR reported withing the last 2.5 hours, Airport LED will be white (nowx).
+        # Only airports that are missing or older than 'cache_ttl' are requested. See metar_cache.py
+        # Airports are requested 300 at a time, several chunks at once. See metar_fetch.py
+        # Thank you Daniel from pilotmap.co for the original routine that handles maps with more than 300 airports.
         print("---> Loading METAR Data")
-        
-        if STATE == "CUSTOM":
-            airports = custom_layout_dict['airports']
-        elif STATE == "USA":
-            airports = usa_ap_dict['USA']
-        else:
-            airports = state_ap_dict[STATE.upper()]
-
-        # Build url with over 300 airports if needed. More flexible and less limiting.
-        # Thank you Daniel from pilotmap.co for the change to this routine that handles maps with more than 300 airports.
-        contentStart = ['<response xmlns:xsd="http://www.w3.org/2001/XMLSchema" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" version="1.2" xsi:noNamespaceSchemaLocation="http://www.aviationweather.gov/static/adds/schema/metar1_2.xsd">']
-        content = []
-        chunk = 0;
-        stationList = ''
-        
-        for airportcode in airports:
-            stationList += airportcode + ','
-            chunk += 1
-            if(chunk >= 300):
-                stationList = stationList[:-1] #strip trailing comma from string
-
-                while True: #check internet availability and retry if necessary. If house power outage, map may boot quicker than router.
-                    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                    s.connect(("8.8.8.8", 80))
-                    ipadd = s.getsockname()[0] #get IP Address
-                    print('RPI IP Address = ' + ipadd) #log IP address when ever FAA weather update is retreived.
-
-                    result = ''
-                    try:
-                        result = urllib.request.urlopen(url + stationList).read()
-                        r = result.decode('UTF-8').splitlines()
-                        xmlStr = r[8:len(r)-1] ##! FAA API CHANGE
-                        content.extend(xmlStr)
-                        c = ['<x>']
-                        c.extend(content)
-                        root = ET.fromstringlist(c + ['</x>'])
-                        print('Internet Available')
-                        break
-                    
-                    except Exception as e:
-                        print(str(e))
-                        print('FAA Data is Not Available')
-                        print(url + stationList)
-                        print(result)
-                        time.sleep(5)
-                        pass
-
-                stationList = ''
-                chunk = 0
-
-        stationList = stationList[:-1] #strip trailing comma from string
-        url = url + stationList         
-            
-        while True: #check internet availability and retry if necessary. If house power outage, map may boot quicker than router.
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            ipadd = s.getsockname()[0] #get IP Address
-            print('RPI IP Address = ' + ipadd) #log IP address when ever FAA weather update is retreived.
-
-            try:
-                result = urllib.request.urlopen(url).read()
-                print('Internet Available')
-                print(url) # Debug
-                r = result.decode('UTF-8').splitlines()
-                xmlStr = r[8:len(r)-1] ##! FAA API CHANGE
-                content.extend(xmlStr)
-                c = ['<x>']
-                c.extend(content)
-                root = ET.fromstringlist(c + ['</x>'])
-                break
-            except:
-                print('FAA Data is Not Available')
-                print(url) # debug
-                time.sleep(5)
-                pass
-
-        c = ['<x>']
-        c.extend(content)
-        root = ET.fromstringlist(c + ['</x>'])
-
-
-    # Grab the airport category, wind speed and various weather from the results given from FAA.
-    # Start of METAR decode routine if 'metar_taf' equals 1. Script will default to this routine without a rotary switch installed.
+        old_metars, old_table = metars, wx_table
+        snapshot, snapshot_time = refresher.published # read once, the refresh may swap in a new one at any time
+        load_apwx(slice_snapshot(snapshot, get_airports(STATE)), snapshot_time)
+        # Only redraw airports whose category, wind or weather has changed, or whose METAR is gone
+        dropped = [airport for airport in old_metars if airport not in metars]
+        changed = [metar.station_id for metar in metars.values() if metar_changed(old_metars.get(metar.station_id), metar)]
+        redraw = wx_table[np.isin(wx_table['station_id'], changed + dropped)] # drawn as NONE if in 'stations.bin'
+        # Airports that are gone and can't be placed any more are cleared back to the outline
+        cleared = old_table[np.isin(old_table['station_id'], dropped) & ~np.isin(old_table['station_id'], wx_table['station_id'])]
+        print("---> %d of %d airports changed" % (len(redraw) + len(cleared), len(metars)))
+    else:
+        redraw = wx_table
+        cleared = wx_table[:0]
+
     if outline == 0 and clear_toggle == 1:
         clear(BLACK)
         clear_toggle = 0
+        redraw = wx_table
         
-    for metar in root.iter('METAR'):
-        stationId = metar.find('station_id').text
-        
-        # Grab flight category from returned FAA data
-        if metar.find('flight_category') is None: # if category is blank, then bypass
-            flightcategory = "NONE"
-        else:
-            flightcategory = metar.find('flight_category').text
-            
-        # Grab lat/lon of airport
-        if metar.find('latitude') is None: # if category is blank, then bypass
-            lat = "0.000"
-        else:
-            lat = metar.find('latitude').text           
-        if metar.find('longitude') is None: # if category is blank, then bypass
-            lon = "0.000"
-        else:
-            lon = metar.find('longitude').text
-            
-        # Grab wind speeds from returned FAA data
-        if metar.find('wind_speed_kt') is None: # if wind speed is blank, then bypass
-            windspeedkt = 0
-        else:
-            windspeedkt = int(metar.find('wind_speed_kt').text)
-            
-        # Grab wind gust from returned FAA data - Lance Blank
-        if metar.find('wind_gust_kt') is None: #if wind speed is blank, then bypass
-            windgustkt = 0
-        else:
-            windgustkt = int(metar.find('wind_gust_kt').text)
-            
-        # Grab wind direction from returned FAA data
-        if metar.find('wind_dir_degrees') is None: # if wind speed is blank, then bypass
-            winddirdegree = 0
-        elif metar.find('wind_dir_degrees').text == 'VRB':
-            winddirdegree = 0
-        else:
-            winddirdegree = int(metar.find('wind_dir_degrees').text)
-            
-        # Grab Weather info from returned FAA data
-        if metar.find('wx_string') is None: # if weather string is blank, then bypass
-            wxstring = "NONE"
-        else:
-            wxstring = metar.find('wx_string').text
-#            print(wxstring) # debug
-        
-        # Build list of airports that report tstorms and lightning in the area
-        if wxstring in wx_lghtn_ck:
-            print(stationId, wxstring) # debug
-            ap_ltng_dict[stationId] = [lat,lon,flightcategory,windspeedkt]
-
-        # Build list of airports that report tstorms and lightning in the area
-        if wxstring in wx_snow_ck:
-#            print(stationId, wxstring) # debug
-            ap_snow_dict[stationId] = [lat,lon,flightcategory,windspeedkt]
-
-        # Build list of airports that report tstorms and lightning in the area
-        if wxstring in wx_rain_ck:
-#            print(stationId, wxstring) # debug
-            ap_rain_dict[stationId] = [lat,lon,flightcategory,windspeedkt]
-
-        # Build list of airports whose winds are higher than max_windspeedkt
-        if windspeedkt >= max_windspeedkt:
-            ap_wind_dict[stationId] = [lat,lon,flightcategory,windspeedkt]
-            
-        # Convert lat/lon into screen coordinates
-        x_unit,y_unit = convert_latlon(float(lat),float(lon))
-
-        # Draw Outline of State on Map
-        pos = (x_unit*MULT,y_unit*MULT)
-        
-        pos1, pos2 = pos
-        r,g,b = get_fc_color(flightcategory)
+    if base_frame is not None:
+        base_draw = ImageDraw.Draw(base_frame) # keep the base frame the same as the display
+
+    # Pixel positions were worked out when the data was loaded, see load_apwx()
+    pixels = [] # cleared airports first, so they don't cover an airport on the same pixel
+    if len(cleared):
+        background = outline_layer(current_view)
+        for pos1, pos2 in zip(cleared['x'].tolist(), cleared['y'].tolist()):
+            if 0 <= pos1 < TOTAL_X and 0 <= pos2 < TOTAL_Y:
+                pixels.append((pos1, pos2, background.getpixel((pos1, pos2))))
+    pixels += [(pos1, pos2, get_fc_color(CATEGORIES[category])) for pos1, pos2, category in
+               zip(redraw['x'].tolist(), redraw['y'].tolist(), redraw['category'].tolist())]
+
+    for pos1, pos2, (r,g,b) in pixels:
         matrix.SetPixel(pos1,pos2,r,g,b) # matrix.SetPixel(i,j,0,0,255) (x,y,R,G,B)
         offscreen_canvas.SetPixel(pos1,pos2,r,g,b) # copy display to offscreen fr
         offscreen_canvas1.SetPixel(pos1,pos2,r,g,b) # copy display to offscreen fr
-
-
-def reset_scale(state):
-    global scale_list,X_OFFSET,Y_OFFSET
-    global flat_lonlat,flat_lat,flat_lon,rand_list,ap_ltng_list
-    if TOTAL_X != TOTAL_Y: # Rectangular Display Scaling
-        scale_list = scalebystate_rect.get(state) # Scale states for Rectangular displays, 64x32 LED Matrix
-    elif TOTAL_X == TOTAL_Y: # Square Display Scaling
-        scale_list = scalebystate_square.get(state) # Scale states for Square displays, 64x64 LED Matrix
-    else:
-        scale_list = scalebystate_square.get(state) # Create a new scalebystate file with custom scaling    
-
-    X_OFFSET = scale_list[0] # Offsets used to adjust image on screen in the X axis
-    Y_OFFSET = scale_list[1] # Offsets used to adjust image on screen in the Y axis
-
-    if state_list_to_use == state_all50_8: # No need to clear lists for all 50 states
-        return
-
-    # Clear previous state's coordinates before displaying the next state.
-    flat_lonlat = [] 
-    flat_lat = []
-    flat_lon = []
-    rand_list = []
-    ap_ltng_dict.clear()
-    ap_wind_dict.clear()
+        if base_frame is not None:
+            base_draw.point((pos1,pos2), fill=(r,g,b))
 
 
 def big_flash(x,y,onoff=1,size=5,iter=1,numflash=3):
@@ -1209,10 +1058,7 @@ def draw_lightning(state):
     if display_lightning == 0:
         return
 
-#    print(ap_ltng_dict) # debug 
-    lat = 0
-    lon = 0
-    coords = []
+#    print(wx_airports(WX_LIGHTNING)) # debug 
 
     if STATE == "CUSTOM":
         airports = custom_layout_dict['airports']
@@ -1221,15 +1067,10 @@ def draw_lightning(state):
     else:
         airports = state_ap_dict[state.upper()] 
         
-    for airport in ap_ltng_dict:
-#        print(airport) # debug
-        coords = ap_ltng_dict.get(airport)
-        lat,lon,flightcategory,windspeedkt = coords
-        x_unit,y_unit = convert_latlon(float(lat),float(lon))
-
-        # Draw on Map
-        pos = (x_unit*MULT,y_unit*MULT)
-        pos1, pos2 = pos
+    ltng = wx_airports(WX_LIGHTNING)
+    for pos1, pos2, category in zip(ltng['x'].tolist(), ltng['y'].tolist(), ltng['category'].tolist()):
+#        print(pos1, pos2) # debug
+        flightcategory = CATEGORIES[category]
  
         if big_ltng_flash == 1: # if big flash is chosen
             draw_apwx(state,1)
@@ -1268,9 +1109,6 @@ def draw_hiwinds(state): # draw high winds airport individually. This takes much
     if display_hiwinds == 0:
         return
     
-    lat = 0
-    lon = 0
-    coords = []
     if STATE == "CUSTOM":
         airports = custom_layout_dict['airports']
     elif STATE == "USA":
@@ -1278,14 +1116,9 @@ def draw_hiwinds(state): # draw high winds airport individually. This takes much
     else:
         airports = state_ap_dict[state.upper()]
         
-    for airport in ap_wind_dict:
-        coords = ap_wind_dict.get(airport)
-        lat,lon,flightcategory,windspeedkt = coords
-        x_unit,y_unit = convert_latlon(float(lat),float(lon))
-
-        # Draw on Map
-        pos = (x_unit*MULT,y_unit*MULT)
-        pos1, pos2 = pos
+    winds = hiwind_airports()
+    for pos1, pos2, category in zip(winds['x'].tolist(), winds['y'].tolist(), winds['category'].tolist()):
+        flightcategory = CATEGORIES[category]
         
         matrix.brightness = hiwind_brightness
         r,g,b = get_fc_color(flightcategory)
@@ -1305,9 +1138,6 @@ def draw_hiwinds1(state): # Draw all high wind airports together, this is much b
         return
 
     global offscreen_canvas
-    lat = 0
-    lon = 0
-    coords = []
     if state == "CUSTOM":
         airports = custom_layout_dict['airports']
     elif STATE == "USA":
@@ -1317,14 +1147,9 @@ def draw_hiwinds1(state): # Draw all high wind airports together, this is much b
     
     draw_apwx(state,1)
 
-    for airport in ap_wind_dict:
-        coords = ap_wind_dict.get(airport)
-        lat,lon,flightcategory,windspeedkt = coords
-        x_unit,y_unit = convert_latlon(float(lat),float(lon))
-
-        # Draw on Map
-        pos = (x_unit*MULT,y_unit*MULT)
-        pos1, pos2 = pos
+    winds = hiwind_airports()
+    for pos1, pos2, category in zip(winds['x'].tolist(), winds['y'].tolist(), winds['category'].tolist()):
+        flightcategory = CATEGORIES[category]
 
         matrix.brightness = hiwind_brightness
         r,g,b = get_fc_color(flightcategory)
@@ -1353,6 +1178,10 @@ def set_brightness():
 ################
 if __name__ == "__main__":
     try:
+        # Watch for the network in the background, nothing waits on it to come up
+        network = NetworkMonitor(metar_fetch.server_address()) # the FAA, or the server in 'metar_url'
+        network.start()
+
         # Load different size fonts
         # See https://github.com/hzeller/rpi-rgb-led-matrix/tree/master/fonts
         # To create your own fonts see https://github.com/hzeller/rpi-rgb-led-matrix/tree/master/fonts
@@ -1397,6 +1226,16 @@ if __name__ == "__main__":
         offscreen_canvas = matrix.CreateFrameCanvas()
         offscreen_canvas1 = matrix.CreateFrameCanvas()
 
+        # Start downloading METAR data while the start up screens are displayed
+        refresh_states = state_list_to_use[0:2]
+        stations = load_stations(PATH+STATION_FILE) # place airports before any METARs are downloaded
+        station_cache.load(PATH+CACHE_FILE, float(metar_age)*60*60) # METARs saved before the last reboot
+        if replay_metars: # display saved data instead of downloading it
+            refresher = MetarReplayer(PATH+replay_metars, replay_speed)
+        else:
+            refresher = MetarRefresher(refresh_airports, metar_age, interval, PATH+CACHE_FILE, network)
+        refresher.start()
+
         if use_wipe:
             # Display image of US Sectional
             display_image()
@@ -1446,7 +1285,12 @@ if __name__ == "__main__":
         while True: # Will continue indefinetly until ctrl-c is pressed.
             set_brightness()
             
-            for STATE in state_list_to_use:
+            for state_num, STATE in enumerate(state_list_to_use):
+                # Have the background refresh get this state's and the next state's airports
+                refresh_states = [STATE, state_list_to_use[(state_num+1) % len(state_list_to_use)]]
+                refresh_asked = time.time()
+                refresher.refresh_now()
+
                 offscreen_canvas.Clear()
                 offscreen_canvas1.Clear()
                 if time_display:
@@ -1457,45 +1301,42 @@ if __name__ == "__main__":
                 else:
                     clear(BLACK)
                     
-                reset_scale(STATE) # get next state's scale information
-                
+                state_name = STATE
                 if STATE == "WASHINGTON D.C.": # force Maryland as state since washington d.c. does not have an outline available via database
                     STATE = "MARYLAND"
 
                 if show_title == 1:
                     display_title()
-                    
-                # use appropriate outline draw routine, USA, State, or Custom.
-                if STATE == "USA":
-                    draw_usa()
-                    draw_apwx(STATE) # Draw each state's airport flight category
-                elif STATE == "CUSTOM":
-                    draw_custom()
-                    draw_apwx(STATE) # Draw each state's airport flight category
-                elif STATE == "ALL50":
-                    # Setup the screen to accommodate all 50 states
-                    outline = 0 # turn off drawing the outline
-                    draw_usa()
-                    draw_outline(string.capwords("ALASKA"))
-                    draw_outline(string.capwords("HAWAII"))
-                    clear(BLACK)
-                    # Now draw the outline of all 50 states  
-                    outline = 1
-                    draw_usa()
-                    draw_outline(string.capwords("ALASKA"))
-                    draw_outline(string.capwords("HAWAII"))
-                       
-                    # Draw the airport weather   
-                    draw_apwx("USA")
-                                                                                                   
+
+                print("\nDisplaying:",display_name(state_name))
+                # Use the outline and airports rendered while the last state was displayed, or render them now
+                if state_name in prerendered:
+                    current_view, image, new_metars, snapshot_time = prerendered.pop(state_name)
                 else:
-                    draw_outline(string.capwords(STATE)) # Draw outline of state
-                    draw_apwx(STATE) # Draw each state's airport flight category
+                    snapshot, snapshot_time = refresher.published # read once, see metar_refresh.py
+                    current_view = load_view(state_name)
+                    new_metars = slice_snapshot(snapshot, current_view['airports'])
+                    image = render_view(current_view, new_metars)
+
+                if use_wipe and STATE != "ALL50":
+                    wipe4(1)
+                show_frame(image) # Display outline of state and each airport's flight category
+                load_apwx(new_metars, snapshot_time)
+
+                # Get the next state ready in the background
+                next_state = state_list_to_use[(state_num+1) % len(state_list_to_use)]
+                threading.Thread(target=prerender, args=(next_state, refresh_asked), daemon=True).start()
  
                 #Setup timed loop for updating FAA Weather that will run based on the value of 'interval' which is a user setting
                 timeout_start = time.time() #Start the timer. When timer hits user-defined value, go back to outer loop to update FAA Weather.
                 while time.time() < timeout_start + interval:
                     set_brightness()
+
+                    if refresher.published[1] != drawn_snapshot_time: # Newer METAR data has been downloaded
+                        if STATE == "ALL50":
+                            draw_apwx("USA")
+                        else:
+                            draw_apwx(STATE)
                     
                     for cycle_num in cycles:
                         if (cycle_num in [2,4]): # Check for Thunderstorms
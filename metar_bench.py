@@ -0,0 +1,83 @@
+# metar_bench.py
+# Support file for ledmap.py - Mark Harris
+# Compares how fast the XML, JSON and CSV decoders in metar_decode.py are on this RPi,
+# to help choose the 'metar_format' setting in ledmap.py.
+#
+# First record the FAA's responses for the 3000 airports list in each format, this only needs
+# to be done once and is saved in BENCH_DIR. Then run the benchmark, it only reads the saved files;
+#   python3 metar_bench.py record
+#   python3 metar_bench.py
+#
+# For each format it reports the size of the responses, the stations decoded per second, using
+# the best of RUNS runs, and the peak memory used while decoding.
+
+import os
+import sys
+import time
+import tracemalloc
+from metar_decode import make_parser, DECODERS
+from metar_fetch import session, make_chunks, METAR_URL, BLOCK_SIZE
+from usa_ap_dict import ap_3000_dict
+
+BENCH_DIR = 'bench_data' # recorded responses, one file per chunk in a folder for each format
+RUNS = 5                 # number of times each format is decoded, the fastest is reported
+METAR_AGE = "2.5"
+
+
+def record(): # Download and save the responses for the 3000 airports in each format
+    for metar_format in DECODERS:
+        os.makedirs(os.path.join(BENCH_DIR, metar_format), exist_ok=True)
+        url = METAR_URL + METAR_AGE + "&format=" + metar_format + "&ids="
+        for num, chunk in enumerate(make_chunks(ap_3000_dict['USA'])):
+            body, resp = session.get(url + ','.join(chunk))
+            with open(os.path.join(BENCH_DIR, metar_format, '%02d.%s' % (num, metar_format)), 'wb') as f:
+                f.write(body)
+        print("Recorded", metar_format)
+
+
+def load(metar_format): # Returns the saved responses for a format
+    folder = os.path.join(BENCH_DIR, metar_format)
+    responses = []
+    for name in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, name), 'rb') as f:
+            responses.append(f.read())
+    return(responses)
+
+
+def decode(metar_format, responses): # Decode the responses like they were downloaded, returns number of stations
+    count = 0
+    for body in responses:
+        parser = make_parser(metar_format)
+        for i in range(0, len(body), BLOCK_SIZE):
+            parser.feed(body[i:i+BLOCK_SIZE])
+        count += len(parser.close())
+    return(count)
+
+
+def bench(metar_format):
+    responses = load(metar_format)
+    best = None
+    for run in range(RUNS):
+        start = time.perf_counter()
+        count = decode(metar_format, responses)
+        secs = time.perf_counter() - start
+        best = secs if best is None else min(best, secs)
+
+    tracemalloc.start() # memory is measured on its own run as tracing slows down the decoding
+    decode(metar_format, responses)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print("%-5s %9d bytes %6d stations %8.3f secs %9.0f stations/sec %9d bytes peak memory" % \
+          (metar_format, sum(len(body) for body in responses), count, best, count/best, peak))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'record':
+        record()
+    else:
+        for metar_format in DECODERS:
+            if os.path.isdir(os.path.join(BENCH_DIR, metar_format)):
+                bench(metar_format)
+            else:
+                print(metar_format, "has not been recorded, run 'python3 metar_bench.py record' first")
@@ -0,0 +1,119 @@
+# metar_cache.py
+# Support file for ledmap.py - Mark Harris
+# Keeps the latest METAR for every airport that has been downloaded, no matter which
+# state, USA or custom map it was downloaded for.
+#
+# Each airport's entry remembers when it was downloaded. Entries younger than 'ttl' seconds
+# are reused, so a state that comes up shortly after the USA map, or after a state that shares
+# some of its airports, only asks the FAA for the airports that are missing or stale.
+# Airports the FAA had no METAR for are remembered too, so they aren't asked for again and again.
+#
+# The cache can be saved to a small binary file with save() and read back with load() when
+# the program starts, so the display has data to show right away after a reboot while the
+# fresh data is downloaded. Each airport is stored as one fixed size record, see RECORD.
+
+import os
+import time
+import struct
+import threading
+from metar_fetch import fetch_metars, print_stats
+from metar_decode import Metar, CATEGORIES, CATEGORY_CODES
+
+CACHE_TTL = 5 * 60 # Seconds to reuse a downloaded METAR before it is downloaded again
+CACHE_MAGIC = b'LEDMAP3\n' # Start of the cache file, changes if RECORD changes
+# time downloaded, has METAR, station_id, observation_time, lat, lon, category, wind speed, gust, direction,
+# wx_string, wx_flags, visibility, ceiling
+RECORD = struct.Struct('<d?8s20sffBHHH32sBfi')
+
+
+class StationCache:
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self.entries = {} # station_id : [time downloaded, Metar or None if FAA had no METAR]
+        self.lock = threading.Lock()
+
+    def stale(self, airports, now=None): # Returns the airports that are missing or older than ttl
+        if now is None:
+            now = time.time()
+        with self.lock:
+            stale = []
+            for airport in dict.fromkeys(airports): # skip airports listed twice
+                entry = self.entries.get(airport)
+                if entry is None or now - entry[0] >= self.ttl:
+                    stale.append(airport)
+        return(stale)
+
+    def update(self, airports, metars, now=None): # Store the result of a download for 'airports'
+        if now is None:
+            now = time.time()
+        with self.lock:
+            for airport in airports:
+                self.entries[airport] = [now, metars.get(airport)]
+
+    def get(self, airports): # Returns dict of station_id : Metar for airports that have a METAR
+        metars = {}
+        with self.lock:
+            for airport in airports:
+                entry = self.entries.get(airport)
+                if entry is not None and entry[1] is not None:
+                    metars[airport] = entry[1]
+        return(metars)
+
+    def save(self, filename): # Write the cache to a file, replacing it only once it is complete
+        with self.lock:
+            entries = list(self.entries.items())
+        data = [CACHE_MAGIC]
+        for airport, (downloaded, metar) in entries:
+            if metar is None:
+                data.append(RECORD.pack(downloaded, False, airport.encode(), b'', 0, 0, 0, 0, 0, 0, b'', 0, 0, 0))
+                continue
+            category = CATEGORY_CODES.get(metar.flight_category, 0)
+            data.append(RECORD.pack(downloaded, True, airport.encode(), metar.observation_time.encode(),
+                                    metar.lat, metar.lon, category, metar.wind_speed_kt, metar.wind_gust_kt,
+                                    metar.wind_dir_degrees, metar.wx_string.encode(), metar.wx_flags,
+                                    metar.visibility_mi, metar.ceiling_ft))
+        with open(filename + '.tmp', 'wb') as f:
+            f.write(b''.join(data))
+        os.replace(filename + '.tmp', filename)
+
+    def load(self, filename, max_age): # Read a saved cache, skipping airports downloaded more than max_age secs ago
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return(0)
+        if not data.startswith(CACHE_MAGIC) or (len(data) - len(CACHE_MAGIC)) % RECORD.size != 0:
+            print("---> Ignoring METAR cache file", filename)
+            return(0)
+
+        now = time.time()
+        count = 0
+        with self.lock:
+            for fields in RECORD.iter_unpack(memoryview(data)[len(CACHE_MAGIC):]):
+                downloaded, has_metar, airport, obs_time, lat, lon, category, speed, gust, direction, wx, flags, visibility, ceiling = fields
+                airport = airport.rstrip(b'\0').decode()
+                if now - downloaded > max_age or airport in self.entries: # keep anything newer already downloaded
+                    continue
+                metar = None
+                if has_metar:
+                    metar = Metar(airport, obs_time.rstrip(b'\0').decode(), lat, lon, CATEGORIES[category],
+                                  speed, gust, direction, wx.rstrip(b'\0').decode(), flags, visibility, ceiling)
+                self.entries[airport] = [downloaded, metar]
+                count += 1
+        return(count)
+
+
+station_cache = StationCache() # shared by every map for the life of the program
+
+
+def get_metars(airports, metar_age="2.5"):
+    # Returns dict of station_id : Metar for 'airports', only downloading the ones that are stale
+    stale = station_cache.stale(airports)
+    print("---> %d of %d airports need updating" % (len(stale), len(airports)))
+    if stale:
+        metars, stats = fetch_metars(stale, metar_age)
+        print_stats(stats)
+        for stat in stats:
+            if stat['error'] == '': # Failed chunks stay stale so they are tried again next time
+                station_cache.update(stat['airports'], metars)
+    return(station_cache.get(airports))
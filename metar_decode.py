@@ -0,0 +1,270 @@
+# metar_decode.py
+# Support file for ledmap.py - Mark Harris
+# Decodes the METAR data returned by the FAA into a compact record for each airport.
+#
+# MetarParser is a streaming parser. Pieces of the FAA's response are fed to it as they
+# are downloaded and each <METAR> element is turned into a 'Metar' record as soon as it
+# is complete, then thrown away. This way the whole XML document is never held in memory
+# and never has to be parsed more than once.
+#
+# The FAA can also send the data as JSON or CSV, which may decode faster on slower RPi's.
+# JsonMetarParser and CsvMetarParser are fed the same way and return the same records.
+# make_parser() returns the parser for a format, see DECODERS. To compare them see metar_bench.py.
+#
+# If the FAA returns more than one METAR for an airport, only the newest one is kept.
+#
+# The weather reported at each airport is classified once, as each record is made, into 'wx_flags'.
+# Each WX_ value is one bit, i.e. metar.wx_flags & WX_LIGHTNING is not 0 if there is lightning.
+# The weather string is split into its groups, i.e. '-TSRA BR' is '-TSRA' and 'BR', and each group into
+# its two letter codes, i.e. 'TS' and 'RA', which are looked up in the WX_ code sets below.
+# The remarks of the raw METAR are checked for lightning too, i.e. 'LTG DSNT W'.
+#
+# The visibility and the ceiling, the lowest broken or overcast layer, are kept so the flight
+# category can be worked out when the FAA leaves it out, see metar_table.py.
+
+import csv
+import json
+import time
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+
+Metar = namedtuple('Metar', ['station_id', 'observation_time', 'lat', 'lon', 'flight_category',
+                             'wind_speed_kt', 'wind_gust_kt', 'wind_dir_degrees', 'wx_string', 'wx_flags',
+                             'visibility_mi', 'ceiling_ft'])
+
+CATEGORIES = ["NONE", "VFR", "MVFR", "IFR", "LIFR"] # flight categories, stored as their index where space counts
+CATEGORY_CODES = {category: code for code, category in enumerate(CATEGORIES)} # "NONE" is code 0
+UNKNOWN = -1         # visibility_mi or ceiling_ft that wasn't reported
+NO_CEILING = 99999   # ceiling_ft when there are no broken or overcast layers
+CEILING_COVERS = frozenset(["BKN", "OVC", "OVX", "VV"]) # sky covers that make a ceiling
+
+# Weather flags
+WX_LIGHTNING = 1 # Thunderstorms and lightning
+WX_SNOW = 2      # Snow, ice pellets etc.
+WX_RAIN = 4      # Rain, drizzle and showers
+WX_FRRAIN = 8    # Freezing rain and drizzle
+WX_DUST = 16     # Dust, sand, haze, smoke and ash
+WX_FOG = 32      # Fog and mist
+
+# METAR weather codes for each flag
+WX_LIGHTNING_CODES = frozenset(["TS", "FC", "SQ"])
+WX_SNOW_CODES = frozenset(["SN", "SG", "IC", "PE", "PL"])
+WX_RAIN_CODES = frozenset(["RA", "DZ"])
+WX_DUST_CODES = frozenset(["DU", "SA", "HZ", "FU", "VA", "PO", "SS", "DS"])
+WX_FOG_CODES = frozenset(["BR", "FG"])
+
+
+def to_int(text): # FAA data may be blank or 'VRB' for variable winds, use 0 for these
+    try:
+        return(int(text))
+    except (TypeError, ValueError):
+        return(0)
+
+
+def to_float(text): # FAA data may be blank, use 0.0 for these
+    try:
+        return(float(text))
+    except (TypeError, ValueError):
+        return(0.0)
+
+
+def to_visibility(text): # Visibility in statute miles, i.e. '10+', '1 1/2' or 0.25. UNKNOWN if blank
+    if text is None or text == '':
+        return(UNKNOWN)
+    try:
+        return(float(text))
+    except ValueError:
+        pass
+    try:
+        miles = 0.0
+        for part in str(text).rstrip('+').replace('SM', '').split():
+            if '/' in part:
+                top, bottom = part.split('/')
+                miles += int(top) / int(bottom)
+            else:
+                miles += float(part)
+        return(miles)
+    except (ValueError, ZeroDivisionError):
+        return(UNKNOWN)
+
+
+def to_ceiling(sky): # Lowest broken or overcast layer from a list of (sky cover, base in feet)
+    if not sky:
+        return(UNKNOWN)
+    ceiling = NO_CEILING
+    for cover, base in sky:
+        if cover in CEILING_COVERS and base not in (None, ''):
+            ceiling = min(ceiling, to_int(base))
+    return(ceiling)
+
+
+def wx_group_flags(group): # Flags for one group of a weather string, i.e. '+FZRA' or 'VCSH'
+    if group.startswith('LTG'): # lightning, i.e. 'LTGICCG' in the remarks
+        return(WX_LIGHTNING)
+    if group == 'VIRGA':
+        return(WX_RAIN)
+    group = group.lstrip('+-')
+    if group.startswith('VC'): # in the vicinity
+        group = group[2:]
+    codes = set([group[i:i+2] for i in range(0, len(group), 2)])
+
+    flags = 0
+    if codes & WX_LIGHTNING_CODES:
+        flags |= WX_LIGHTNING
+    if codes & WX_SNOW_CODES:
+        flags |= WX_SNOW
+    if codes & WX_RAIN_CODES:
+        flags |= WX_FRRAIN if 'FZ' in codes else WX_RAIN
+    elif codes == {'SH'}: # showers, i.e. 'VCSH'
+        flags |= WX_RAIN
+    if codes & WX_DUST_CODES:
+        flags |= WX_DUST
+    if codes & WX_FOG_CODES:
+        flags |= WX_FOG
+    return(flags)
+
+
+def wx_flags(wx_string, raw_text=''): # Flags for all the weather reported in a METAR
+    flags = 0
+    for group in wx_string.split():
+        flags |= wx_group_flags(group)
+    remarks = raw_text.partition(' RMK ')[2]
+    for group in remarks.split():
+        if group.startswith('LTG'):
+            flags |= WX_LIGHTNING
+    return(flags)
+
+
+def make_record(fields): # Turn a dict of the fields of a METAR, named as in the XML, into a Metar record
+    return(Metar(station_id = fields.get('station_id'),
+                 observation_time = fields.get('observation_time') or '',
+                 lat = to_float(fields.get('latitude')),
+                 lon = to_float(fields.get('longitude')),
+                 flight_category = fields.get('flight_category') or "NONE",
+                 wind_speed_kt = to_int(fields.get('wind_speed_kt')),
+                 wind_gust_kt = to_int(fields.get('wind_gust_kt')),
+                 wind_dir_degrees = to_int(fields.get('wind_dir_degrees')),
+                 wx_string = fields.get('wx_string') or "NONE",
+                 wx_flags = wx_flags(fields.get('wx_string') or '', fields.get('raw_text') or ''),
+                 visibility_mi = to_visibility(fields.get('visibility_statute_mi')),
+                 ceiling_ft = to_ceiling(fields.get('sky'))))
+
+
+def add_record(metars, metar): # Keep only the newest METAR for each airport
+    old = metars.get(metar.station_id)
+    if old is None or metar.observation_time > old.observation_time:
+        metars[metar.station_id] = metar
+
+
+def metar_changed(old, new): # True if an airport's category, wind or weather is different in the new METAR
+    if old is None:
+        return(True)
+    if old.observation_time == new.observation_time: # same observation
+        return(False)
+    return((old.flight_category, old.wind_speed_kt, old.wind_gust_kt, old.wind_dir_degrees, old.wx_string,
+            old.visibility_mi, old.ceiling_ft) != \
+           (new.flight_category, new.wind_speed_kt, new.wind_gust_kt, new.wind_dir_degrees, new.wx_string,
+            new.visibility_mi, new.ceiling_ft))
+
+
+class MetarParser: # Feed it the FAA's response in pieces, then call close() to get the records
+    def __init__(self):
+        self.parser = ET.XMLPullParser(events=('start', 'end'))
+        self.parents = []  # elements that are open, used to detach each METAR once it is decoded
+        self.metars = {}   # station_id : Metar
+
+    def feed(self, data):
+        self.parser.feed(data)
+        self.read_events()
+
+    def close(self): # Returns dict of station_id : Metar
+        self.parser.close()
+        self.read_events()
+        return(self.metars)
+
+    def read_events(self):
+        for event, elem in self.parser.read_events():
+            if event == 'start':
+                self.parents.append(elem)
+                continue
+
+            self.parents.pop()
+            if elem.tag == 'METAR':
+                fields = {'sky': []}
+                for child in elem: # one pass through the element is quicker than calling find() for each field
+                    if child.tag == 'sky_condition':
+                        fields['sky'].append((child.get('sky_cover'), child.get('cloud_base_ft_agl')))
+                    else:
+                        fields[child.tag] = child.text
+                metar = make_record(fields)
+                if metar.station_id:
+                    add_record(self.metars, metar)
+                if self.parents: # throw away the element so the tree never grows
+                    self.parents[-1].remove(elem)
+
+
+class JsonMetarParser: # Same as MetarParser for format=json, the list is decoded once it is all downloaded
+    # JSON names : XML names
+    FIELDS = {'icaoId': 'station_id', 'lat': 'latitude', 'lon': 'longitude', 'fltCat': 'flight_category',
+              'wspd': 'wind_speed_kt', 'wgst': 'wind_gust_kt', 'wdir': 'wind_dir_degrees',
+              'wxString': 'wx_string', 'rawOb': 'raw_text', 'visib': 'visibility_statute_mi'}
+
+    def __init__(self):
+        self.blocks = []
+
+    def feed(self, data):
+        self.blocks.append(data)
+
+    def close(self): # Returns dict of station_id : Metar
+        metars = {}
+        data = b''.join(self.blocks)
+        self.blocks = []
+        for item in json.loads(data) if data.strip() else []:
+            fields = {xml_name: item.get(name) for name, xml_name in self.FIELDS.items()}
+            fields['sky'] = [(cloud.get('cover'), cloud.get('base')) for cloud in item.get('clouds') or []]
+            if item.get('obsTime'): # seconds since 1970, written the same way as the XML
+                fields['observation_time'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(item['obsTime']))
+            metar = make_record(fields)
+            if metar.station_id:
+                add_record(metars, metar)
+        return(metars)
+
+
+class CsvMetarParser: # Same as MetarParser for format=csv, each line is decoded as soon as it is complete
+    def __init__(self):
+        self.rest = b''     # start of a line that hasn't been completely downloaded yet
+        self.header = None  # column names, lines before them are notes from the FAA and are skipped
+        self.metars = {}
+
+    def feed(self, data):
+        lines = (self.rest + data).split(b'\n')
+        self.rest = lines.pop()
+        self.read_lines(lines)
+
+    def close(self): # Returns dict of station_id : Metar
+        self.read_lines([self.rest])
+        self.rest = b''
+        return(self.metars)
+
+    def read_lines(self, lines):
+        for row in csv.reader([line.decode('utf-8', 'replace') for line in lines if line.strip()]):
+            if self.header is None:
+                if 'station_id' in row:
+                    self.header = row
+                    # there are several sky_cover and cloud_base_ft_agl columns, one for each layer
+                    self.covers = [i for i, name in enumerate(row) if name == 'sky_cover']
+                    self.bases = [i for i, name in enumerate(row) if name == 'cloud_base_ft_agl']
+                continue
+            fields = dict(zip(self.header, row))
+            fields['sky'] = [(row[cover], row[base] if base < len(row) else '')
+                             for cover, base in zip(self.covers, self.bases) if cover < len(row) and row[cover]]
+            metar = make_record(fields)
+            if metar.station_id:
+                add_record(self.metars, metar)
+
+
+DECODERS = {'xml': MetarParser, 'json': JsonMetarParser, 'csv': CsvMetarParser} # format : parser
+
+
+def make_parser(metar_format='xml'): # New parser for data in 'metar_format'
+    return(DECODERS[metar_format]())
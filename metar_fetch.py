@@ -0,0 +1,288 @@
+# metar_fetch.py
+# Support file for ledmap.py - Mark Harris
+# Downloads METAR data from the FAA for a list of airports.
+#
+# The FAA limits how many airports can be asked for in one request, so the list of airports
+# is broken into chunks of CHUNK_SIZE airports. The chunks are requested in parallel, up to
+# MAX_WORKERS at a time, and each chunk is timed out and retried on its own. A chunk that
+# still fails after CHUNK_RETRIES attempts is skipped so one bad request can't hang the display.
+# Each chunk is decoded as it is downloaded, see metar_decode.py, and the records of all the
+# chunks are then merged into a single snapshot. The FAA is asked for the data in 'metar_format',
+# "xml", "json" or "csv", which ledmap.py sets from its 'metar_format' variable.
+# If 'record_dir' is set, every response is also saved to a file there, see metar_replay.py.
+# set_metar_url() gets the data from another server instead of the FAA, i.e. fake_faa.py.
+#
+# Requests go through 'session', a pool of keep-alive connections that is kept for the life of
+# the program. This saves a new TLS handshake for every chunk and every update, and asks the
+# FAA for gzip'd data which is much smaller to download. See session.stats() for the savings.
+#
+# The last response for each chunk is remembered. The next request for the same chunk asks the
+# FAA to only send it if it has changed (ETag/If-Modified-Since), and if the data still comes back
+# the same, checked with a hash of the data, the records decoded last time are used again.
+
+import time
+import zlib
+import hashlib
+import threading
+import http.client
+import urllib.request, urllib.error, urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from metar_decode import make_parser, add_record
+from metar_replay import record_response
+
+METAR_URL = "https://aviationweather.gov/api/data/metar?hours="
+CHUNK_SIZE = 300    # Max number of airports to ask for in each request
+MAX_WORKERS = 4     # Number of chunks to request at the same time
+CHUNK_TIMEOUT = 20  # Seconds to wait on a chunk before that attempt is given up
+CHUNK_RETRIES = 3   # Number of attempts for each chunk before it is skipped
+RETRY_WAIT = 5      # Seconds to wait between attempts
+BLOCK_SIZE = 16384  # Bytes read from the network at a time
+MAX_CHUNKS_SAVED = 100 # Number of chunks to remember the last response of
+
+
+class MetarSession: # Pool of keep-alive HTTP(S) connections, reused across chunks and updates
+    def __init__(self, timeout=CHUNK_TIMEOUT, max_idle=MAX_WORKERS):
+        self.timeout = timeout
+        self.max_idle = max_idle # idle connections to keep open for each host
+        self.idle = {}           # (scheme, host) : list of idle connections
+        self.lock = threading.Lock()
+        self.requests = 0        # number of requests made
+        self.handshakes = 0      # number of new connections opened, each one costs a TCP+TLS handshake
+        self.bytes_on_wire = 0   # bytes downloaded, gzip'd if the server compressed them
+        self.bytes_decoded = 0   # bytes after decompression
+
+    def get_conn(self, scheme, host): # Reuse an idle connection if one is available
+        with self.lock:
+            pool = self.idle.get((scheme, host), [])
+            if pool:
+                return(pool.pop(), True)
+            self.handshakes += 1
+        if scheme == 'https':
+            return(http.client.HTTPSConnection(host, timeout=self.timeout), False)
+        return(http.client.HTTPConnection(host, timeout=self.timeout), False)
+
+    def put_conn(self, scheme, host, conn): # Return connection to the pool for the next request
+        with self.lock:
+            pool = self.idle.setdefault((scheme, host), [])
+            if len(pool) < self.max_idle:
+                pool.append(conn)
+                return
+        conn.close()
+
+    def release(self, scheme, host, conn, resp): # Keep connection open unless the server is closing it
+        if resp.will_close:
+            conn.close()
+        else:
+            self.put_conn(scheme, host, conn)
+
+    def get(self, url, on_data=None, headers=None):
+        # Returns (body, response). Body is the decoded body of the response. If 'on_data' is given,
+        # it is called with each decoded piece of the body as it arrives instead and body is None.
+        # 'headers' are added to the request, a '304 Not Modified' response returns a body of None.
+        # A '204 No Content' response is returned like a 200 with an empty body.
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path + '?' + parts.query
+        headers = dict(headers or {}, **{'Accept-Encoding': 'gzip', 'Connection': 'keep-alive', 'User-Agent': 'ledmap'})
+
+        while True:
+            conn, reused = self.get_conn(parts.scheme, parts.netloc)
+            try:
+                conn.request('GET', path, headers=headers)
+                resp = conn.getresponse()
+                break
+            except (http.client.RemoteDisconnected, ConnectionError, http.client.BadStatusLine):
+                conn.close()
+                if not reused: # The server closed an idle connection, try again with a new one
+                    raise
+            except Exception:
+                conn.close()
+                raise
+
+        if resp.status not in (200, 204):
+            resp.read()
+            self.release(parts.scheme, parts.netloc, conn, resp)
+            with self.lock:
+                self.requests += 1
+            if resp.status == 304: # Not Modified, nothing was downloaded
+                return(None, resp)
+            raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, None)
+
+        if resp.getheader('Content-Encoding', '') == 'gzip':
+            unzip = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        else:
+            unzip = None
+        body = []
+        wire = 0
+        decoded = 0
+
+        try:
+            while True:
+                block = resp.read(BLOCK_SIZE)
+                done = not block
+                wire += len(block)
+                if unzip:
+                    block = unzip.flush() if done else unzip.decompress(block)
+                decoded += len(block)
+                if block:
+                    if on_data is None:
+                        body.append(block)
+                    else:
+                        on_data(block)
+                if done:
+                    break
+        except Exception:
+            conn.close() # rest of the response was not read so the connection can't be reused
+            raise
+        self.release(parts.scheme, parts.netloc, conn, resp)
+
+        with self.lock:
+            self.requests += 1
+            self.bytes_on_wire += wire
+            self.bytes_decoded += decoded
+
+        if on_data is None:
+            return(b''.join(body), resp)
+        return(None, resp)
+
+    def stats(self):
+        with self.lock:
+            return({'requests': self.requests, 'handshakes': self.handshakes,
+                    'bytes_on_wire': self.bytes_on_wire, 'bytes_decoded': self.bytes_decoded})
+
+    def close(self):
+        with self.lock:
+            for pool in self.idle.values():
+                for conn in pool:
+                    conn.close()
+            self.idle = {}
+
+
+session = MetarSession() # shared by every request for the life of the program
+metar_format = "xml"     # format to ask the FAA for, see DECODERS in metar_decode.py
+record_dir = ""          # folder to save every response to, "" to not save them
+chunk_cache = {}         # url : the last response for each chunk, used to tell if the data has changed
+chunk_lock = threading.Lock()
+
+
+def set_metar_url(url): # Get the METARs from another server, keeping any query string 'url' already has
+    global METAR_URL
+    parts = urllib.parse.urlsplit(url)
+    query = urllib.parse.parse_qsl(parts.query) + [('hours', '')] # the hours are added to the end, see fetch_metars()
+    METAR_URL = urllib.parse.urlunsplit(parts._replace(query=urllib.parse.urlencode(query)))
+
+
+def server_address(): # (host, port) of the server the METARs come from, for network_monitor.py to check
+    parts = urllib.parse.urlsplit(METAR_URL)
+    return((parts.hostname, parts.port or (443 if parts.scheme == 'https' else 80)))
+
+
+def make_chunks(airports, size=CHUNK_SIZE): # Break list of airports into lists of 'size' airports
+    return([airports[i:i+size] for i in range(0, len(airports), size)])
+
+
+def fetch_chunk(url, metar_format, retries=CHUNK_RETRIES):
+    # Returns dict of station_id : Metar along with stats about the request.
+    # The dict is None if all attempts failed. 'changed' in the stats is False if the
+    # FAA's data for the chunk is the same as last time, and the last records were reused.
+    start = time.time()
+    error = ''
+    for attempt in range(1, retries+1):
+        try:
+            metars, changed = download_chunk(url, metar_format)
+            return(metars, {'latency': time.time()-start, 'attempts': attempt, 'error': '', 'changed': changed})
+        except Exception as e:
+            error = str(e)
+            if attempt < retries:
+                time.sleep(RETRY_WAIT)
+    return(None, {'latency': time.time()-start, 'attempts': retries, 'error': error, 'changed': True})
+
+
+def download_chunk(url, metar_format): # Returns (metars, changed)
+    with chunk_lock:
+        last = chunk_cache.get(url)
+    headers = {}
+    if last is not None: # Ask the FAA to only send the data if it has changed
+        if last['etag']:
+            headers['If-None-Match'] = last['etag']
+        if last['modified']:
+            headers['If-Modified-Since'] = last['modified']
+
+    digest = hashlib.sha1()
+    blocks = []
+    if last is None: # Nothing to compare to, decode the data as it arrives
+        parser = make_parser(metar_format)
+        def on_data(block):
+            digest.update(block)
+            parser.feed(block)
+            if record_dir: # hold on to the data to save it
+                blocks.append(block)
+    else: # Hold on to the data until it is known to have changed
+        def on_data(block):
+            digest.update(block)
+            blocks.append(block)
+
+    body, resp = session.get(url, on_data, headers)
+    if resp.status == 304:
+        return(last['metars'], False)
+    if resp.status == 204: # No Content, none of the airports have a METAR within 'metar_age'
+        changed = last is None or len(last['metars']) != 0
+        metars = {}
+    else:
+        changed = True
+        if record_dir:
+            record_response(record_dir, b''.join(blocks), metar_format)
+        if last is not None:
+            if digest.digest() == last['hash']: # same data as last time, no need to decode it again
+                return(last['metars'], False)
+            parser = make_parser(metar_format)
+            for block in blocks:
+                parser.feed(block)
+        metars = parser.close()
+
+    with chunk_lock:
+        chunk_cache.pop(url, None)
+        chunk_cache[url] = {'etag': resp.getheader('ETag'), 'modified': resp.getheader('Last-Modified'),
+                            'hash': digest.digest(), 'metars': metars}
+        while len(chunk_cache) > MAX_CHUNKS_SAVED: # forget the oldest chunks
+            del chunk_cache[next(iter(chunk_cache))]
+    return(metars, changed)
+
+
+def fetch_metars(airports, metar_age="2.5", workers=MAX_WORKERS):
+    # Returns (metars, stats). 'metars' is a dict of station_id : Metar for all the chunks,
+    # 'stats' holds one dict per chunk with its airports, latency, number of attempts and any error.
+    fmt = metar_format # the same format for every chunk, even if it is changed while downloading
+    url = METAR_URL + str(metar_age) + "&format=" + fmt + "&ids="
+    chunks = make_chunks(list(airports))
+    metars = {}
+    stats = []
+    if len(chunks) == 0:
+        return(metars, stats)
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+        results = pool.map(lambda chunk: fetch_chunk(url + ','.join(chunk), fmt), chunks)
+
+        for num, (chunk_metars, stat) in enumerate(results): # results come back in chunk order
+            stat['chunk'] = num
+            stat['airports'] = chunks[num]
+            if chunk_metars is not None:
+                for metar in chunk_metars.values():
+                    add_record(metars, metar)
+            stats.append(stat)
+
+    return(metars, stats)
+
+
+def print_stats(stats): # Log how each chunk did
+    for stat in stats:
+        if stat['error'] == '' and not stat['changed']:
+            result = 'OK, unchanged'
+        elif stat['error'] == '':
+            result = 'OK'
+        else:
+            result = 'FAILED ' + stat['error']
+        print("---> Chunk %d: %d airports, %.2f secs, %d attempt(s), %s" % \
+              (stat['chunk'], len(stat['airports']), stat['latency'], stat['attempts'], result))
+    total = session.stats()
+    print("---> Session: %d requests, %d handshakes, %d bytes on wire, %d bytes decoded" % \
+          (total['requests'], total['handshakes'], total['bytes_on_wire'], total['bytes_decoded']))
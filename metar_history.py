@@ -0,0 +1,77 @@
+# metar_history.py
+# Support file for ledmap.py - Mark Harris
+# Remembers the last few observations of each airport, for trends and playback of the weather.
+#
+# StationHistory is filled by the background refresh, see metar_refresh.py, from the data it already
+# downloaded, so no extra requests are made to the FAA. Each airport gets a row of SIZE slots in
+# NumPy arrays that are made once, up to MAX_STATIONS airports. Each new observation goes in the
+# next slot of the airport's row, writing over the oldest one, so the memory used never grows.
+# An observation is only added once, no matter how many times the same METAR is downloaded.
+#
+# get() returns an airport's observations from the last HISTORY_HOURS hours, oldest first.
+
+import time
+import calendar
+import threading
+import numpy as np
+from metar_decode import CATEGORY_CODES
+
+MAX_STATIONS = 4000 # Most airports to keep the history of, enough for every map
+SIZE = 16           # Observations kept for each airport, METARs are hourly plus any specials
+HISTORY_HOURS = 6   # Hours of history returned by get()
+
+
+def obs_seconds(observation_time): # '2023-11-14T22:00:00Z' as seconds since 1970, 0 if it is blank
+    try:
+        return(calendar.timegm(time.strptime(observation_time, '%Y-%m-%dT%H:%M:%SZ')))
+    except ValueError:
+        return(0)
+
+
+class StationHistory:
+    def __init__(self, max_stations=MAX_STATIONS, size=SIZE):
+        self.size = size
+        self.rows = {}   # station_id : row in the arrays
+        self.last = {}   # station_id : observation_time of the last observation added
+        self.lock = threading.Lock()
+        self.obs_time = np.zeros((max_stations, size), dtype=np.float64) # 0 if the slot is empty
+        self.category = np.zeros((max_stations, size), dtype=np.uint8)   # see CATEGORY_CODES
+        self.wind = np.zeros((max_stations, size), dtype=np.int16)
+        self.gust = np.zeros((max_stations, size), dtype=np.int16)
+        self.wx = np.zeros((max_stations, size), dtype=np.uint8)         # WX_ flags, see metar_decode.py
+        self.next = np.zeros(max_stations, dtype=np.int32)               # slot to write next in each row
+
+    def add(self, metars): # Add any new observations from a dict of station_id : Metar
+        with self.lock:
+            for metar in metars.values():
+                if self.last.get(metar.station_id) == metar.observation_time: # already added
+                    continue
+                row = self.rows.get(metar.station_id)
+                if row is None:
+                    if len(self.rows) >= len(self.next): # full, the airport isn't kept
+                        continue
+                    row = self.rows[metar.station_id] = len(self.rows)
+                self.last[metar.station_id] = metar.observation_time
+
+                slot = self.next[row]
+                self.obs_time[row, slot] = obs_seconds(metar.observation_time)
+                self.category[row, slot] = CATEGORY_CODES.get(metar.flight_category, 0)
+                self.wind[row, slot] = metar.wind_speed_kt
+                self.gust[row, slot] = metar.wind_gust_kt
+                self.wx[row, slot] = metar.wx_flags
+                self.next[row] = (slot + 1) % self.size
+
+    def get(self, station_id, hours=HISTORY_HOURS):
+        # Returns list of (observation time in seconds since 1970, category code, wind, gust, wx flags), oldest first
+        with self.lock:
+            row = self.rows.get(station_id)
+            if row is None:
+                return([])
+            order = (np.arange(self.size) + self.next[row]) % self.size # oldest slot first
+            columns = [self.obs_time[row, order], self.category[row, order], self.wind[row, order],
+                       self.gust[row, order], self.wx[row, order]]
+        keep = columns[0] >= time.time() - hours*60*60 # empty slots are 0 so they are left out too
+        return(list(zip(*[column[keep].tolist() for column in columns])))
+
+
+station_history = StationHistory() # filled by the background refresh for the life of the program
@@ -0,0 +1,82 @@
+# metar_refresh.py
+# Support file for ledmap.py - Mark Harris
+# Downloads METAR data in the background so the display never has to wait on the FAA.
+#
+# MetarRefresher is a thread that gets the airports it should keep up to date from the
+# function passed to it, downloads them (see metar_cache.py), then publishes the result
+# in 'published' as (snapshot, time published), the snapshot a dict of station_id : Metar.
+# A new dict is built for each refresh and swapped in together with its time as one tuple,
+# so the display always sees a complete snapshot and the time that goes with it, without a lock.
+# Read 'published' once and unpack it, i.e. 'snapshot, snapshot_time = refresher.published'. It refreshes every 'interval' seconds, or sooner when refresh_now() is called.
+# A snapshot that is the same as the last one isn't published, so the display isn't redrawn.
+# wait_refreshed() waits for a refresh to finish whether or not it published anything.
+# Each new snapshot is also added to the history of each airport, see metar_history.py.
+#
+# If 'cache_file' is given, the station cache is saved to it after each refresh. When the thread
+# starts it first publishes whatever is already in the station cache, i.e. loaded from that file
+# after a reboot, so the display has something to draw before the first download finishes.
+# If a NetworkMonitor is given, see network_monitor.py, it waits for the network to come up
+# instead of trying downloads that can't work.
+
+import time
+import threading
+from metar_cache import get_metars, station_cache
+from metar_history import station_history
+
+
+class MetarRefresher(threading.Thread):
+    def __init__(self, get_airports, metar_age="2.5", interval=5*60, cache_file=None, network=None):
+        threading.Thread.__init__(self, name='MetarRefresher', daemon=True)
+        self.get_airports = get_airports # function that returns the airports to keep up to date
+        self.metar_age = metar_age
+        self.interval = interval
+        self.cache_file = cache_file     # file to save the station cache to, None to not save it
+        self.network = network           # NetworkMonitor, if given no downloads are tried while offline
+        self.published = ({}, 0)         # (latest complete snapshot, time published), 0 if there isn't one yet
+        self.wake = threading.Event()
+        self.refreshed = 0               # time the last finished refresh was started, 0 if none has finished
+        self.done = threading.Condition()
+
+    def refresh_now(self): # Don't wait for the interval, i.e. when the display switches states
+        self.wake.set()
+
+    def wait_refreshed(self, since, timeout=None): # Wait for a refresh started after 'since' to finish
+        # Returns True once one has, or False if timeout runs out first
+        with self.done:
+            return(self.done.wait_for(lambda: self.refreshed >= since, timeout))
+
+    def refresh(self):
+        airports = self.get_airports()
+        snapshot = get_metars(airports, self.metar_age)
+        if len(snapshot) == 0 and len(airports) != 0:
+            print('FAA Data is Not Available') # keep the old snapshot until the FAA can be reached
+            return
+        if snapshot == self.published[0]: # nothing changed, so there is nothing new to draw
+            return
+        self.published = (snapshot, time.time()) # swap in the new snapshot
+        station_history.add(snapshot)
+        if self.cache_file:
+            station_cache.save(self.cache_file)
+
+    def run(self):
+        snapshot = station_cache.get(self.get_airports()) # data saved before the last reboot, if any
+        if snapshot:
+            print("---> Using %d saved METARs until new data is downloaded" % len(snapshot))
+            self.published = (snapshot, time.time())
+            station_history.add(snapshot)
+
+        while True:
+            self.wake.clear()
+            if self.network is not None and not self.network.online:
+                print('Waiting for Network')
+                if not self.network.wait_online(self.interval):
+                    continue
+            started = time.time()
+            try:
+                self.refresh()
+            except Exception as e: # keep going, the next refresh may work
+                print('METAR Refresh Failed:', e)
+            with self.done:
+                self.refreshed = started
+                self.done.notify_all()
+            self.wake.wait(self.interval)
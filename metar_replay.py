@@ -0,0 +1,126 @@
+# metar_replay.py
+# Support file for ledmap.py - Mark Harris
+# Records the FAA's responses to files and plays them back, to see a bad weather day again
+# or to test how fast the display is without the internet.
+#
+# Recording; set 'record_metars' in ledmap.py to a folder and every response downloaded from
+# the FAA is saved in it, see metar_fetch.py. Each file is named for the time it was downloaded,
+# i.e. '20231114-220012.345-000007.xml', and ends with the format it is in.
+#
+# Playback; set 'replay_metars' in ledmap.py to a folder of recorded responses. MetarReplayer then
+# takes the place of MetarRefresher, see metar_refresh.py. It decodes the files in the order they
+# were recorded and publishes them as snapshots with the same time between them as when they were
+# recorded, divided by 'speed'. i.e. speed=60 plays an hour in a minute, speed=0 as fast as it can.
+# Files recorded within GROUP_SECS of each other were one refresh, and are published together.
+# Snapshots are never published less than MIN_SECS apart, as the display redraws for each one.
+#
+# To time decoding the recorded responses without a display, i.e. on a Linux box;
+#   python3 metar_replay.py folder
+
+import os
+import sys
+import time
+import itertools
+import threading
+from metar_decode import make_parser, add_record, DECODERS
+from metar_history import station_history
+
+GROUP_SECS = 10 # Files recorded within this many seconds of each other are published together
+MIN_SECS = 1    # Least time between published snapshots, even at speed=0
+file_count = itertools.count() # makes each file name unique when chunks finish at the same time
+
+
+def record_response(folder, body, metar_format): # Save a response from the FAA
+    now = time.time()
+    name = time.strftime('%Y%m%d-%H%M%S', time.localtime(now)) + '.%03d-%06d.%s' % \
+           (int(now * 1000) % 1000, next(file_count), metar_format)
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, name), 'wb') as f:
+        f.write(body)
+
+
+def recorded_time(name): # Time a file was recorded, in seconds since 1970, from its name
+    return(time.mktime(time.strptime(name[:15], '%Y%m%d-%H%M%S')) + int(name[16:19]) / 1000)
+
+
+def load_groups(folder): # Returns list of (time recorded, list of file names) for each refresh, in order
+    names = sorted(name for name in os.listdir(folder) if name.rpartition('.')[2] in DECODERS)
+    groups = []
+    for name in names:
+        try:
+            recorded = recorded_time(name)
+        except ValueError: # not a recorded response
+            continue
+        if groups and recorded - groups[-1][2] <= GROUP_SECS:
+            groups[-1][1].append(name)
+            groups[-1][2] = recorded
+        else:
+            groups.append([recorded, [name], recorded]) # time of first and last file in the group
+    return([(recorded, names) for recorded, names, last in groups])
+
+
+def decode_file(filename): # Returns dict of station_id : Metar from a recorded response
+    parser = make_parser(filename.rpartition('.')[2])
+    with open(filename, 'rb') as f:
+        parser.feed(f.read())
+    return(parser.close())
+
+
+class MetarReplayer(threading.Thread): # Used in place of MetarRefresher, see metar_refresh.py
+    def __init__(self, folder, speed=1, loop=True):
+        threading.Thread.__init__(self, name='MetarReplayer', daemon=True)
+        self.folder = folder
+        self.speed = speed   # 1 = real time, 60 = an hour a minute, 0 = as fast as it can, see MIN_SECS
+        self.loop = loop     # start again from the beginning once it has all been played
+        self.published = ({}, 0) # (latest complete snapshot, time published), see metar_refresh.py
+
+    def refresh_now(self): # The recording sets the pace, so there is nothing to do
+        pass
+
+    def wait_refreshed(self, since, timeout=None): # Nothing to wait for, see refresh_now()
+        return(True)
+
+    def run(self):
+        while True:
+            groups = load_groups(self.folder)
+            if not groups:
+                print('No Recorded METARs in', self.folder)
+                return
+            last = groups[0][0]
+            snapshot = {} # each pass starts over, or the older METARs would never replace the last ones played
+            for recorded, names in groups:
+                wait = (recorded - last) / self.speed if self.speed > 0 else 0
+                if self.published[1]:
+                    time.sleep(max(wait, MIN_SECS - (time.time() - self.published[1])))
+                last = recorded
+
+                snapshot = dict(snapshot) # METARs not in this refresh are kept, like the station cache
+                for name in names:
+                    for metar in decode_file(os.path.join(self.folder, name)).values():
+                        add_record(snapshot, metar)
+                print("---> Replaying %s, %d files" % (time.ctime(recorded), len(names)))
+                self.published = (snapshot, time.time()) # swap in the new snapshot
+                station_history.add(snapshot)
+            if not self.loop:
+                return
+
+
+if __name__ == "__main__":
+    from metar_table import make_table
+    folder = sys.argv[1]
+    snapshot = {}
+    files = 0
+    decode_secs = 0
+    table_secs = 0
+    for recorded, names in load_groups(folder):
+        start = time.perf_counter()
+        for name in names:
+            for metar in decode_file(os.path.join(folder, name)).values():
+                add_record(snapshot, metar)
+        decode_secs += time.perf_counter() - start
+        start = time.perf_counter()
+        make_table(snapshot)
+        table_secs += time.perf_counter() - start
+        files += len(names)
+    print("%d files, %d stations, %.3f secs decoding, %.3f secs making tables" % \
+          (files, len(snapshot), decode_secs, table_secs))
@@ -0,0 +1,62 @@
+# metar_table.py
+# Support file for ledmap.py - Mark Harris
+# Holds the METAR data of the displayed map as columns, used by the lightning and high wind effects.
+#
+# make_table() turns a snapshot, dict of station_id : Metar, into a NumPy structured array with
+# one row per airport. Lat/lon are already numbers and the flight category is a small code, so
+# the effects can pick out their airports with one test on a whole column instead of looping
+# through dictionaries of strings, which matters on a Pi Zero with 3000 airports.
+# i.e. table[table['wind'] >= 15] is every airport with high winds.
+#
+# The 'wx' column holds flags for the weather reported at each airport, see the WX_ values in metar_decode.py.
+# Airports the FAA gave no flight category for get one worked out from their visibility and
+# ceiling, for all of them at once, see derive_categories(). The 'derived' column marks them.
+#
+# If the local station list is given, see station_db.py, airports with no METAR are added as
+# category "NONE" so they can still be drawn, and airports whose METAR has no lat/lon are placed.
+# The 'x' and 'y' columns are the airport's position on the display. They are left at 0 here and
+# filled in by ledmap.py once for each snapshot and map, so the effects don't convert lat/lon each cycle.
+#
+# Requires NumPy, 'sudo apt install python3-numpy'
+
+import numpy as np
+from metar_decode import CATEGORY_CODES, UNKNOWN, NO_CEILING
+
+METAR_DTYPE = np.dtype([('station_id', 'U8'), ('lat', 'f8'), ('lon', 'f8'), ('category', 'u1'),
+                        ('wind', 'i2'), ('gust', 'i2'), ('direction', 'i2'), ('wx', 'u1'),
+                        ('visibility', 'f4'), ('ceiling', 'i4'), ('derived', '?'),
+                        ('x', 'i2'), ('y', 'i2')])
+
+
+def make_table(metars, airports=(), stations=None): # 'stations' is dict of station_id : Station
+    stations = stations or {}
+    rows = []
+    for metar in metars.values():
+        lat, lon = metar.lat, metar.lon
+        station = stations.get(metar.station_id)
+        if lat == 0 and lon == 0 and station is not None: # FAA left out the lat/lon
+            lat, lon = station.lat, station.lon
+        rows.append((metar.station_id, lat, lon, CATEGORY_CODES.get(metar.flight_category, 0),
+                     metar.wind_speed_kt, metar.wind_gust_kt, metar.wind_dir_degrees, metar.wx_flags,
+                     metar.visibility_mi, metar.ceiling_ft, False, 0, 0))
+
+    for airport in airports: # airports with no METAR
+        station = stations.get(airport)
+        if station is not None and airport not in metars:
+            rows.append((airport, station.lat, station.lon, 0, 0, 0, 0, 0, UNKNOWN, UNKNOWN, False, 0, 0))
+    table = np.array(rows, dtype=METAR_DTYPE)
+    derive_categories(table)
+    return(table)
+
+
+def derive_categories(table): # Work out the flight category of airports without one from visibility and ceiling
+    visibility = np.where(table['visibility'] == UNKNOWN, np.inf, table['visibility'])
+    ceiling = np.where(table['ceiling'] == UNKNOWN, NO_CEILING, table['ceiling'])
+    category = np.select([(ceiling < 500) | (visibility < 1),     # LIFR
+                          (ceiling < 1000) | (visibility < 3),    # IFR
+                          (ceiling <= 3000) | (visibility <= 5)], # MVFR
+                         [CATEGORY_CODES["LIFR"], CATEGORY_CODES["IFR"], CATEGORY_CODES["MVFR"]],
+                         CATEGORY_CODES["VFR"])
+    derive = (table['category'] == 0) & ((table['visibility'] != UNKNOWN) | (table['ceiling'] != UNKNOWN))
+    table['category'][derive] = category[derive]
+    table['derived'] = derive
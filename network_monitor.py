@@ -0,0 +1,66 @@
+# network_monitor.py
+# Support file for ledmap.py - Mark Harris
+# Watches the network connection in the background so nothing else has to wait on it.
+#
+# NetworkMonitor is a thread that looks up the RPi's IP address and checks that the server
+# the METARs come from can be reached, the FAA's or a local test server, see fake_faa.py.
+# The results are kept in 'ip_address' and 'online' so the display and the METAR downloads
+# can check them at any time without waiting. When the network is
+# down it checks again after 1 sec, then 2, 4, 8... up to MAX_BACKOFF secs, so after a
+# house power outage the map finds the router as soon as it is back up.
+
+import time
+import socket
+import threading
+
+CHECK_HOST = ("aviationweather.gov", 443) # server that must be reachable to be online, see 'metar_url' in ledmap.py
+CHECK_INTERVAL = 60 # Seconds between checks while online
+CHECK_TIMEOUT = 5   # Seconds to wait on each check
+MAX_BACKOFF = 60    # Most seconds to wait between checks while offline
+
+
+class NetworkMonitor(threading.Thread):
+    def __init__(self, check_host=CHECK_HOST):
+        threading.Thread.__init__(self, name='NetworkMonitor', daemon=True)
+        self.check_host = check_host
+        self.ip_address = ''  # last known IP address of the RPi, '' if it has never had one
+        self.online = False   # True if the METAR server could be reached on the last check
+        self.up = threading.Event()
+
+    def wait_online(self, timeout=None): # Returns True once online, or False if timeout runs out first
+        return(self.up.wait(timeout))
+
+    def get_ip_address(self): # IP address of the interface used to reach the internet
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            s.connect(("8.8.8.8", 80)) # UDP, nothing is actually sent
+            return(s.getsockname()[0])
+        finally:
+            s.close()
+
+    def check(self): # Returns True if online
+        try:
+            self.ip_address = self.get_ip_address()
+        except OSError: # no route to the internet, a server on the local network may still be reachable
+            pass
+        try:
+            socket.create_connection(self.check_host, CHECK_TIMEOUT).close()
+            return(True)
+        except OSError:
+            return(False)
+
+    def run(self):
+        backoff = 1
+        while True:
+            online = self.check()
+            if online != self.online:
+                print("Network is", "Available" if online else "Not Available", self.ip_address)
+            self.online = online
+            if online:
+                self.up.set()
+                backoff = 1
+                time.sleep(CHECK_INTERVAL)
+            else:
+                self.up.clear()
+                time.sleep(backoff)
+                backoff = min(backoff * 2, MAX_BACKOFF)
@@ -0,0 +1,85 @@
+# outline_cache.py
+# Support file for ledmap.py - Mark Harris
+# Keeps the outline of each state drawn into an image, so it is only drawn once and not every time
+# the state comes up. Drawing Alaska or the USA line by line takes far longer than copying an image.
+#
+# Each image is saved under a key made of everything that changes how the outline looks, the state,
+# display size, offsets, the boundaries used to turn lon/lat into pixels and the outline settings.
+# See outline_key() in ledmap.py. If any of them change, the outline is drawn again.
+#
+# The images are kept in memory, the ones used longest ago are dropped once they take up more than
+# 'max_bytes'. If a folder is given the images are saved there as .png files too, so they don't have
+# to be drawn again after a reboot. See 'outline_cache' in ledmap.py.
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+MAX_BYTES = 8 * 1024 * 1024 # Most memory the images can take up, about 40 images on a 256x192 display
+VERSION = 2 # Changes when the way outlines are drawn changes, so images saved before aren't used
+
+
+def image_bytes(image): # Memory an image takes up
+    return(image.width * image.height * len(image.getbands()))
+
+
+class LayerCache:
+    def __init__(self, max_bytes=MAX_BYTES, folder=''):
+        self.max_bytes = max_bytes
+        self.folder = folder     # folder to save the images in, '' = only keep them in memory
+        self.images = OrderedDict() # key : image, the one used longest ago first
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock() # the next state is drawn in the background, see prerender() in ledmap.py
+
+    def filename(self, key): # Name of the file an image is saved in
+        return(os.path.join(self.folder, hashlib.sha1(repr((VERSION, key)).encode()).hexdigest() + '.png'))
+
+    def get(self, key): # Returns the image saved under key, None if there isn't one
+        with self.lock:
+            image = self.images.get(key)
+            if image is not None:
+                self.images.move_to_end(key) # used last
+                self.hits += 1
+                return(image)
+
+        if self.folder and os.path.exists(self.filename(key)):
+            try:
+                with Image.open(self.filename(key)) as f:
+                    image = f.convert('RGB') # loads it all so the file can be closed
+            except OSError: # can't be read, it will be drawn again
+                image = None
+            if image is not None:
+                self.put(key, image, save=False)
+                with self.lock:
+                    self.hits += 1
+                return(image)
+
+        with self.lock:
+            self.misses += 1
+        return(None)
+
+    def put(self, key, image, save=True): # Keep an image under key, dropping the images used longest ago if needed
+        with self.lock:
+            if key in self.images:
+                self.bytes -= image_bytes(self.images.pop(key))
+            self.images[key] = image
+            self.bytes += image_bytes(image)
+            while self.bytes > self.max_bytes and len(self.images) > 1:
+                old_key, old_image = self.images.popitem(last=False)
+                self.bytes -= image_bytes(old_image)
+
+        if save and self.folder:
+            try:
+                os.makedirs(self.folder, exist_ok=True)
+                image.save(self.filename(key) + '.tmp', 'PNG')
+                os.replace(self.filename(key) + '.tmp', self.filename(key))
+            except OSError as e: # keep going with just the one in memory
+                print('Outline Cache Not Saved', e)
+
+    def stats(self):
+        with self.lock:
+            return({'images': len(self.images), 'bytes': self.bytes, 'hits': self.hits, 'misses': self.misses})
@@ -0,0 +1,179 @@
+# outline_store.py
+# Support file for ledmap.py - Mark Harris
+# Holds the outlines of the states, the USA and the custom map so the json files are only read once.
+#
+# The outlines are kept in 'outlines.bin', built from 'statelatlon.json.txt', 'gz_2010_us_outline_20m.json'
+# and the 'custom_outline' in 'custom_layout.py'. The file holds all the coordinates as one packed
+# array of float32 lon/lat pairs, a table of where each group starts, and a table of the groups and
+# the box around each state. It is memory mapped, so starting up doesn't read 3+ MB of json into
+# lists of lists, and only the groups that are drawn are read from the SD card.
+#
+# The file is built the first time it is needed, and again whenever one of the files it is built
+# from is changed. To build it by hand run this from the ledmap directory;
+#   python3 outline_store.py
+#
+# An outline is a list of groups, each group an array of [lon, lat] coordinates like in the json files.
+#
+# simplify() drops the coordinates of a group that are too close to the line between their neighbours to
+# be seen, using the Douglas-Peucker method. A state is drawn with far fewer lines that look the same.
+
+import os
+import json
+import mmap
+import struct
+import threading
+import numpy as np
+from custom_layout import custom_layout_dict
+
+STATES_FILE = 'statelatlon.json.txt'        # outline of each state
+USA_FILE = 'gz_2010_us_outline_20m.json'    # outline of the USA
+CUSTOM_FILE = 'custom_layout.py'            # outline of the custom map
+OUTLINE_FILE = 'outlines.bin'
+OUTLINE_MAGIC = b'LEDOUT1\n' # Start of the outline file, changes if the layout changes
+HEADER = struct.Struct('<III')     # number of outlines, groups and coordinates
+FEATURE = struct.Struct('<32sII4f') # name, first group, number of groups, min lon, min lat, max lon, max lat
+
+
+class OutlineStore:
+    def __init__(self, path=''):
+        self.path = path      # folder the outline files are in
+        self.index = None     # NAME : (first group, number of groups, bounds), None until loaded
+        self.starts = None    # where each group starts in 'coords', plus where the last one ends
+        self.coords = None    # all the coordinates, a (number of coordinates, 2) float32 array
+        self.built = 0        # time the outline file was built, changes when the outlines do
+        self.lock = threading.Lock()
+
+    def load(self): # Map the outline file, building it first if needed. Only the first time this is called
+        with self.lock:
+            if self.index is not None:
+                return
+            filename = self.path + OUTLINE_FILE
+            sources = [self.path + STATES_FILE, self.path + USA_FILE, self.path + CUSTOM_FILE]
+            if outdated(filename, sources):
+                print("---> Building", filename)
+                build(read_json(self.path), filename)
+
+            self.built = os.path.getmtime(filename)
+            with open(filename, 'rb') as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if data[:len(OUTLINE_MAGIC)] != OUTLINE_MAGIC:
+                raise ValueError("Not an outline file: " + filename)
+            features, groups, coords = HEADER.unpack_from(data, len(OUTLINE_MAGIC))
+            offset = len(OUTLINE_MAGIC) + HEADER.size
+            index = {}
+            for num in range(features):
+                name, first, count, *bounds = FEATURE.unpack_from(data, offset + num*FEATURE.size)
+                index[name.rstrip(b'\0').decode()] = (first, count, tuple(bounds))
+            offset += features * FEATURE.size
+            self.starts = np.frombuffer(data, dtype='<u4', count=groups+1, offset=offset)
+            offset += (groups+1) * 4
+            self.coords = np.frombuffer(data, dtype='<f4', count=coords*2, offset=offset).reshape(-1, 2)
+            self.index = index
+
+    def groups(self, name): # Groups that make up an outline, [] if there is no such outline
+        self.load()
+        if name.upper() not in self.index:
+            return([])
+        first, count, bounds = self.index[name.upper()]
+        return([self.coords[self.starts[i]:self.starts[i+1]] for i in range(first, first+count)])
+
+    def state(self, name): # Groups that make up the outline of a state
+        return(self.groups(name))
+
+    def state_bounds(self, name): # (min lon, min lat, max lon, max lat) of a state
+        self.load()
+        return(self.index[name.upper()][2])
+
+    def usa(self): # Groups that make up the outline of the USA
+        return(self.groups('USA'))
+
+    def custom(self): # Groups that make up the outline of the custom map
+        return(self.groups('CUSTOM'))
+
+
+def outdated(filename, sources): # True if the file is missing or older than any of its sources
+    if not os.path.exists(filename):
+        return(True)
+    built = os.path.getmtime(filename)
+    return(any(os.path.exists(source) and os.path.getmtime(source) > built for source in sources))
+
+
+def read_json(path=''): # Returns dict of NAME : list of groups from the json files and custom_layout.py
+    outlines = {}
+    with open(path + STATES_FILE) as f:
+        data = json.load(f)
+    for feature in data['features']:
+        coords = feature['geometry']['coordinates']
+        if feature['geometry']['type'] == 'MultiPolygon': # For states with multiple discontiguous areas
+            outlines[feature['properties']['NAME'].upper()] = [polygon[0] for polygon in coords]
+        else: # For states with one contiguous area
+            outlines[feature['properties']['NAME'].upper()] = [coords[0]]
+
+    with open(path + USA_FILE) as f:
+        data = json.load(f)
+    outlines['USA'] = [feature['geometry']['coordinates'] for feature in data['features']]
+
+    outlines['CUSTOM'] = [custom_layout_dict['custom_outline']]
+    return(outlines)
+
+
+def build(outlines, filename): # Write the outlines to a packed file
+    features = []
+    starts = [0]
+    coords = []
+    for name, groups in outlines.items():
+        features.append(FEATURE.pack(name.encode(), len(starts)-1, len(groups), *group_bounds(groups)))
+        for group in groups:
+            coords.append(np.asarray(group, dtype='<f4').reshape(-1, 2))
+            starts.append(starts[-1] + len(group))
+    data = [OUTLINE_MAGIC, HEADER.pack(len(features), len(starts)-1, starts[-1])] + features
+    data.append(np.asarray(starts, dtype='<u4').tobytes())
+    data.append(np.concatenate(coords).tobytes())
+    with open(filename + '.tmp', 'wb') as f:
+        f.write(b''.join(data))
+    os.replace(filename + '.tmp', filename)
+
+
+def group_bounds(groups): # (min lon, min lat, max lon, max lat) around all the groups
+    coords = np.concatenate([np.asarray(group, dtype=np.float64).reshape(-1, 2) for group in groups])
+    return((coords[:, 0].min(), coords[:, 1].min(), coords[:, 0].max(), coords[:, 1].max()))
+
+
+def simplify(coords, tolerance, scale=(1, 1)): # Douglas-Peucker, drops coords less than 'tolerance' from the line drawn without them
+    # coords is an (n,2) array, returns the coords kept, always including the first and last.
+    # Distances are measured after multiplying the coords by 'scale', i.e. pixels per degree of lon and lat
+    if tolerance <= 0 or len(coords) < 3:
+        return(coords)
+    points = coords * np.asarray(scale, dtype=np.float64)
+    keep = np.zeros(len(coords), dtype=bool)
+    keep[0] = keep[-1] = True
+    sections = [(0, len(coords)-1)] # sections of the line still to be checked
+    while sections:
+        first, last = sections.pop()
+        if last - first < 2:
+            continue
+        start = points[first]
+        between = points[first+1:last] - start
+        line = points[last] - start
+        length = np.hypot(line[0], line[1])
+        if length == 0: # the group closes back on its first point
+            distance = np.hypot(between[:, 0], between[:, 1])
+        else:
+            distance = np.abs(line[0]*between[:, 1] - line[1]*between[:, 0]) / length
+        farthest = distance.argmax()
+        if distance[farthest] > tolerance: # keep it and check the line on each side of it
+            middle = first + 1 + farthest
+            keep[middle] = True
+            sections.append((first, middle))
+            sections.append((middle, last))
+    return(coords[keep])
+
+
+def merge_bounds(bounds1, bounds2): # Box around two boxes
+    return((min(bounds1[0], bounds2[0]), min(bounds1[1], bounds2[1]),
+            max(bounds1[2], bounds2[2]), max(bounds1[3], bounds2[3])))
+
+
+if __name__ == "__main__":
+    build(read_json(), OUTLINE_FILE)
+    print("Saved outlines to", OUTLINE_FILE)
@@ -0,0 +1,94 @@
+# station_db.py
+# Support file for ledmap.py - Mark Harris
+# Local list of where every airport is, so airports can be placed on the map before any
+# METAR data has been downloaded, and airports with no recent METAR can still be drawn.
+#
+# The list is built from the FAA's stations list, the same list 'state_ap_dict.py' was made from,
+# and saved to 'stations.bin' as one small fixed size record per airport, see RECORD.
+# To build it, run this once from the ledmap directory;
+#   python3 station_db.py               # downloads the stations list from STATIONS_URL
+#   python3 station_db.py stations.txt  # or use a copy of the list that was already downloaded
+#
+# load_stations() reads 'stations.bin' into a dict of station_id : Station. If the file hasn't
+# been built, it returns an empty dict and airports are only placed once their METAR comes in.
+
+import re
+import sys
+import struct
+import urllib.request
+from collections import namedtuple
+
+STATIONS_URL = "https://www.aviationweather.gov/docs/metar/stations.txt"
+STATION_FILE = 'stations.bin'
+STATION_MAGIC = b'LEDSTN1\n' # Start of the station file, changes if RECORD changes
+# station_id, lat, lon, elevation in meters, state, country
+RECORD = struct.Struct('<4sffh2s2s')
+
+Station = namedtuple('Station', ['station_id', 'lat', 'lon', 'elevation', 'state', 'country'])
+
+# i.e. 'CO DENVER INTL      KDEN  DEN   72565  39 51N  104 39W 1640   X     T          6 US'
+# state, name, ICAO id in columns 21-24, lat degrees minutes, lon degrees minutes, elevation and country in columns 82-83
+LINE = re.compile(r'^([A-Z ]{2}) .{16} ([A-Z0-9]{4}) .*? (\d+) (\d+)([NS]) +(\d+) (\d+)([EW]) +(-?\d+)')
+
+
+def parse_line(line): # Returns a Station, or None if the line isn't a station with an ICAO id
+    match = LINE.match(line)
+    if match is None:
+        return(None)
+    state, station_id, lat_d, lat_m, ns, lon_d, lon_m, ew, elevation = match.groups()
+    lat = int(lat_d) + int(lat_m) / 60
+    lon = int(lon_d) + int(lon_m) / 60
+    country = line[81:83].strip() if len(line) >= 83 else ''
+    return(Station(station_id, -lat if ns == 'S' else lat, -lon if ew == 'W' else lon,
+                   int(elevation), state.strip(), country))
+
+
+def parse_stations(text): # Returns dict of station_id : Station from the stations list
+    stations = {}
+    for line in text.splitlines():
+        if line.startswith('!'): # comment
+            continue
+        station = parse_line(line)
+        if station is not None:
+            stations[station.station_id] = station
+    return(stations)
+
+
+def save_stations(stations, filename):
+    data = [STATION_MAGIC]
+    for station in stations.values():
+        data.append(RECORD.pack(station.station_id.encode(), station.lat, station.lon, station.elevation,
+                                station.state.encode(), station.country.encode()))
+    with open(filename, 'wb') as f:
+        f.write(b''.join(data))
+
+
+def load_stations(filename): # Returns dict of station_id : Station, empty if the file hasn't been built
+    try:
+        with open(filename, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return({})
+    if not data.startswith(STATION_MAGIC) or (len(data) - len(STATION_MAGIC)) % RECORD.size != 0:
+        print("---> Ignoring station file", filename)
+        return({})
+
+    stations = {}
+    for station_id, lat, lon, elevation, state, country in RECORD.iter_unpack(memoryview(data)[len(STATION_MAGIC):]):
+        station_id = station_id.rstrip(b'\0').decode()
+        stations[station_id] = Station(station_id, lat, lon, elevation,
+                                       state.rstrip(b'\0').decode(), country.rstrip(b'\0').decode())
+    return(stations)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding='latin-1') as f:
+            text = f.read()
+    else:
+        print("Downloading", STATIONS_URL)
+        text = urllib.request.urlopen(STATIONS_URL, timeout=60).read().decode('latin-1')
+
+    stations = parse_stations(text)
+    save_stations(stations, STATION_FILE)
+    print("Saved %d stations to %s" % (len(stations), STATION_FILE))